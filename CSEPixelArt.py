@@ -26,6 +26,11 @@ The height of an image is the number of rows in it. The width of an image is the
 number of columns, which is the number of pixels in a row. All rows need to have
 the same number of pixels.
 
+Images created or loaded by this library are PixelImage objects. A PixelImage
+keeps its pixels in one NumPy array, but behaves like the list of rows above:
+IMG[R][C] reads a pixel as a tuple and IMG[R][C] = (r, g, b) changes it. Plain
+lists of rows can be used anywhere a PixelImage can.
+
 There are functions in this library to create blank images, copy images, load
 images from various images formats, and save images to PNG format, and save a
 list of images to an animated GIF format.
@@ -33,19 +38,153 @@ list of images to an animated GIF format.
 The functions in this library are:
   load_img: loads an image from disk
   load_anim: loads an animated image from disk (eg: animated GIF)
+  iter_anim: loads the frames of an animated image one at a time
   create_img: creates an empty image
   copy_img: copies an image
   get_height: returns the height of an image (number of rows)
   get_width: returns the width of an image (number of columns)
   save_img: saves an image to disk as a PNG file
   save_anim: saves a list of images to disk as an animated GIF file
+  export_img: saves an image at several scales in one go
+  export_anim: saves an animation at several scales in one go
+  cache_images: sets up the cache of loaded images
 """
 
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from PIL import Image
+from PIL import GifImagePlugin, Image
+
+from filecache import FileCache
+import profiling
 
 
-def load_img(filename, size=None, resample_filter=Image.LANCZOS):
+class PixelRow:
+    """
+    One row of a PixelImage. Reading a pixel returns a tuple of three
+    integers, writing a pixel changes the image the row belongs to.
+
+    Single pixels are read and written through a memoryview of the image
+    array, which is faster than NumPy indexing for single values. Pixel by
+    pixel loops still take about 5 times as long as over lists of tuples,
+    in exchange for images taking 3 bytes a pixel and being saved without
+    a conversion.
+    """
+    __slots__ = ('image', 'row')
+
+    def __init__(self, image, row):
+        self.image = image
+        self.row = row
+
+    def __len__(self):
+        return self.image.array.shape[1]
+
+    def __getitem__(self, col):
+        if isinstance(col, slice):
+            return [tuple(pix) for pix in self.image.array[self.row, col].tolist()]
+        (pixels, row) = (self.image.pixels, self.row)
+        return (pixels[row, col, 0], pixels[row, col, 1], pixels[row, col, 2])
+
+    def __setitem__(self, col, pix):
+        image = self.image
+        if not isinstance(col, slice):
+            (pixels, row) = (image.writeable_pixels(), self.row)
+            try:
+                (pixels[row, col, 0], pixels[row, col, 1], pixels[row, col, 2]) = pix
+                return
+            except (TypeError, ValueError):
+                # floats, NumPy values and values out of range are
+                # converted by NumPy below
+                pass
+        image.writeable_array()[self.row, col] = pix
+
+    def __iter__(self):
+        for pix in self.image.array[self.row].tolist():
+            yield tuple(pix)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class PixelImage:
+    """
+    An image in the CSEPixelArt format stored as a height by width by 3
+    NumPy array of uint8. It is used like a list of rows: img[r][c],
+    len(img), len(img[0]) and iterating over rows all work.
+
+    numpy.asarray(img) returns the array itself, without converting the
+    pixels to Python objects.
+
+    The array can be shared with other images (loaded images share the
+    pixels kept by the image cache) and is then read-only. The image gets
+    its own copy the first time one of its pixels is changed, arrays
+    returned before that keep the shared pixels.
+    """
+    __slots__ = ('array', 'pixels', 'rows')
+
+    def __init__(self, array):
+        self.array = np.ascontiguousarray(array, dtype=np.uint8)
+        # memoryview of the array, for reading and writing single values
+        self.pixels = memoryview(self.array)
+        # made once, img[r] is then a list lookup
+        self.rows = [PixelRow(self, row) for row in range(self.array.shape[0])]
+
+    def __reduce__(self):
+        return (PixelImage, (self.array,))
+
+    def __array__(self, dtype=None, copy=None):
+        # the array itself rather than an array interface, so views are
+        # based on the array that owns the pixels
+        if copy:
+            return np.array(self.array, dtype)
+        return np.asarray(self.array, dtype)
+
+    def writeable_array(self):
+        """returns the array, copying it first if it is shared"""
+        if not self.array.flags.writeable:
+            self.array = self.array.copy()
+            self.pixels = memoryview(self.array)
+        return self.array
+
+    def writeable_pixels(self):
+        """returns the memoryview of writeable_array()"""
+        if self.pixels.readonly:
+            self.writeable_array()
+        return self.pixels
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def __getitem__(self, row):
+        return self.rows[row]
+
+    def __setitem__(self, row, pixels):
+        self.writeable_array()[row] = np.asarray(pixels, dtype=np.uint8)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __eq__(self, other):
+        return np.array_equal(self.array, np.asarray(other))
+
+    def copy(self):
+        return PixelImage(self.array.copy())
+
+    def __repr__(self):
+        return 'PixelImage(%r)' % [list(row) for row in self]
+
+
+def load_img(filename, size=None, resample_filter=Image.LANCZOS, as_array=False):
     """
     Loads an image from a file, optionally resizes it and returns it in the
     CSEPixelArt image format (list of lists of pixels)
@@ -62,8 +201,21 @@ def load_img(filename, size=None, resample_filter=Image.LANCZOS):
     default is CSEPixelArt.Image.LANCZOS. For details on possible filters, see:
     https://pillow.readthedocs.io/en/stable/handbook/concepts.html#filters
 
-    returns: An image as a list of lists of pixels. If the loaded file
-    is an animated GIF, only returns the first animation frame. 
+    as_array: Optional, if True the image is returned as a read-only Numpy
+    array of height by width by 3 uint8 values instead. This is the fast way
+    to load large images: the pixels are decoded straight into the array,
+    uncompressed PPM and BMP files are memory mapped instead of read, and
+    JPEG files being shrunk are decoded at a reduced size to begin with.
+    Use numpy.array(img) to get a copy that can be changed.
+
+    returns: An image (a PixelImage, used as a list of lists of pixels). If
+    the loaded file is an animated GIF, only returns the first animation
+    frame. 
+
+    Decoded images are kept in a cache (see cache_images), so loading the
+    same file again with the same size and filter is immediate as long as
+    the file hasn't changed. Changing the returned image doesn't change the
+    cached one.
 
     EXAMPLE USES
 
@@ -89,12 +241,22 @@ def load_img(filename, size=None, resample_filter=Image.LANCZOS):
     new_height =  int(h * (new_width/w))
     img_scaled = load_img("foo.jpg", (new_width, new_height))
 
+    # loads a large photo as a Numpy array, shrinking it to 32x32
+    arr = load_img("photo.jpg", (32, 32), as_array=True)
+
     """
-    pil_img = Image.open(filename)
-    return pil_to_pixart(pil_img, size, resample_filter)
+    if size is not None:
+        size = tuple(size)
+    if as_array and size is None and isinstance(filename, (str, os.PathLike)):
+        arr = map_rgb(filename)
+        if arr is not None:
+            return arr
+    arr = image_cache.load(filename, ('img', size, resample_filter, as_array),
+                           lambda: [decode_img(filename, size, resample_filter, as_array)])[0]
+    return arr if as_array else PixelImage(arr)
 
 
-def load_anim(filename, size=None, resample_filter=Image.LANCZOS):
+def load_anim(filename, size=None, resample_filter=Image.LANCZOS, as_array=False):
     """
     Loads an animation from a animated image file format (for example an
     animated GIF), optionally resizes each image in the animation and returns
@@ -105,19 +267,51 @@ def load_anim(filename, size=None, resample_filter=Image.LANCZOS):
     If the provided filename refers to a file that has a single image (e.g.: a
     JPEG file, or a non-animated GIF file), the returned list will have a single
     element in it.
+
+    Like load_img, the decoded frames are kept in the image cache.
     """
-    pil_img = Image.open(filename)
+    if size is not None:
+        size = tuple(size)
+    frames = image_cache.load(filename, ('anim', size, resample_filter, as_array),
+                              lambda: [np.asarray(img) for img in iter_anim(filename, size, resample_filter,
+                                                                            as_array=as_array)])
+    # a new list, so callers changing it don't change the cached one
+    return list(frames) if as_array else [PixelImage(frame) for frame in frames]
+
 
-    is_animated = getattr(pil_img, "is_animated", False)
+def iter_anim(filename, size=None, resample_filter=Image.LANCZOS,
+              start=0, stop=None, step=1, as_array=False):
+    """
+    Loads the frames of an animation one at a time. Each frame is only
+    decoded, resized and converted when the loop asks for it, so long
+    animations can be processed without holding every frame in memory.
 
-    if is_animated:
-        result = []
-        for i in range(pil_img.n_frames):
+    The parameters filename, size, resample_filter and as_array are the same
+    as for load_img. start, stop and step select frames the same way as a
+    slice of a list: frames start, start + step, ... up to but not including
+    stop. Negative values count from the last frame.
+
+    EXAMPLE USES
+
+    from CSEPixelArt import *
+
+    # the first 10 frames, resized to 32x32
+    for img in iter_anim("foo.gif", (32, 32), stop=10):
+        ...
+
+    # every other frame
+    frames = list(iter_anim("foo.gif", step=2))
+
+    """
+    with Image.open(filename) as pil_img:
+        if not getattr(pil_img, "is_animated", False):
+            if 0 in range(1)[start:stop:step]:
+                yield load_img(filename, size, resample_filter, as_array)
+            return
+
+        for i in range(pil_img.n_frames)[start:stop:step]:
             pil_img.seek(i)
-            result.append(pil_to_pixart(pil_img, size, resample_filter))
-        return result
-    else:
-        return [pil_to_pixart(pil_img, size, resample_filter)]
+            yield pil_to_pixart(pil_img, size, resample_filter, as_array)
 
 
 def create_img(height, width, color):
@@ -132,7 +326,7 @@ def create_img(height, width, color):
 
     color: RGB pixel as a tuple of 3 integers
 
-    returns: An image as a list of lists of pixels
+    returns: An image (a PixelImage, used as a list of lists of pixels)
 
     EXAMPLE USES
 
@@ -142,10 +336,9 @@ def create_img(height, width, color):
     img = create_img(16, 16, (255, 255, 255))
 
     """
-    result = [None] * height
-    for i in range(len(result)):
-        result[i] = [color] * width
-    return result
+    result = np.empty((height, width, 3), dtype=np.uint8)
+    result[:] = color
+    return PixelImage(result)
 
 
 def copy_img(img):
@@ -169,6 +362,8 @@ def copy_img(img):
         return red_img
 
     """
+    if isinstance(img, PixelImage):
+        return img.copy()
     return [[pix for pix in row] for row in img]
 
 
@@ -186,36 +381,203 @@ def get_width(img):
     return len(img[0])
 
 
-def pil_to_pixart(pil_img, size=None, resample_filter=Image.LANCZOS):
+def pil_to_pixart(pil_img, size=None, resample_filter=Image.LANCZOS, as_array=False):
     """
     THIS IS A PRIVATE FUNCTION: no need to use this function from the outside     
 
-    Convert a Pillow image to an image in CSEPixelArt library format (which is a list
-    of lists of pixels)
+    Convert a Pillow image to an image in CSEPixelArt library format (a
+    PixelImage, which is used as a list of lists of pixels), or to a read-only
+    Numpy array if as_array is True
     """
     if size is not None:
-        pil_img = pil_img.resize(size, resample=resample_filter)
+        if as_array:
+            # shrink by whole factors first, then filter the rest of the way
+            pil_img = pil_img.resize(size, resample=resample_filter, reducing_gap=3.0)
+        else:
+            pil_img = pil_img.resize(size, resample=resample_filter)
 
     # Convert to RGB format, if it's not already in the format
     pil_img = pil_img.convert("RGB")
 
-    # Convert to Numpy 3D array, height by width by 3 
-    arr = np.array(pil_img.getdata(), dtype=np.uint8).reshape(pil_img.height, pil_img.width, 3)
+    if as_array:
+        # Pillow hands its decoded bytes over through the array interface
+        return np.asarray(pil_img)
 
-    # Convert to a list of list of tuples. This removes all numpy arrays to make
-    # it easier for clients of the library to manipulate the data (it also makes
-    # things slower, but for small images it's not a problem)
-    img = [[(int(p[0]), int(p[1]), int(p[2])) for p in row] for row in arr]
+    # Copy into a Numpy 3D array, height by width by 3. The PixelImage hands
+    # out tuples as pixels are read, so no Python object is made per pixel
+    # up front
+    return PixelImage(np.array(pil_img, dtype=np.uint8))
 
-    return img
+
+def decode_img(filename, size=None, resample_filter=Image.LANCZOS, as_array=False):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Decode an image file into a height by width by 3 Numpy array, the way
+    load_img does without its cache
+    """
+    with Image.open(filename) as pil_img:
+        if as_array and size is not None:
+            # let decoders that can (JPEG) scale down while decoding
+            pil_img.draft("RGB", size)
+        return np.asarray(pil_to_pixart(pil_img, size, resample_filter, as_array))
+
+
+class ImageCache:
+    """
+    THIS IS A PRIVATE CLASS: no need to use this class from the outside
+
+    Decoded images kept in memory, and optionally as .npy files in a
+    directory, so a file is only decoded again when it changes. Entries are
+    keyed by the file path, modification time and size, plus how the file
+    was decoded. The least recently used entries are dropped once the
+    memory entries go past max_bytes, or the directory past disk_bytes.
+
+    Every cached array is read-only, so callers can't change what other
+    callers are given.
+    """
+    EXTENSION = '.npy'
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, disk_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+        self.files = None
+        if directory is not None:
+            self.files = FileCache(directory, disk_bytes, self.EXTENSION)
+
+    def load(self, filename, options, decode):
+        """returns the list of frames of filename decoded with options,
+        calling decode() to get them if they aren't cached"""
+        if not isinstance(filename, (str, bytes, os.PathLike)):
+            # an open file has no path and modification time to check
+            return decode()
+
+        status = os.stat(filename)
+        key = (os.path.abspath(filename), status.st_mtime_ns, status.st_size) + options
+        with self.lock:
+            frames = self.entries.get(key)
+            if frames is not None:
+                self.entries.move_to_end(key)
+                return frames
+
+        frames = self.read(key) if self.files is not None else None
+        if frames is None:
+            frames = decode()
+            for frame in frames:
+                frame.flags.writeable = False
+            if self.files is not None:
+                self.write(key, frames)
+
+        size = sum(frame.nbytes for frame in frames)
+        with self.lock:
+            if size <= self.max_bytes and key not in self.entries:
+                self.entries[key] = frames
+                self.total += size
+                while self.total > self.max_bytes:
+                    (old_key, old_frames) = self.entries.popitem(last=False)
+                    self.total -= sum(frame.nbytes for frame in old_frames)
+        return frames
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total = 0
+
+    def read(self, key):
+        entry = self.files.entry(repr(key))
+        try:
+            # frames are stacked in one array, mapped rather than read
+            stack = np.load(entry, mmap_mode='r')
+            self.files.touch(entry)
+        except (OSError, ValueError):
+            return None
+        return list(stack)
+
+    def write(self, key, frames):
+        try:
+            self.files.write(self.files.entry(repr(key)), lambda entry_file: np.save(entry_file, np.stack(frames)))
+        except (OSError, ValueError):
+            # frames of different sizes, or a full disk: just don't keep them
+            pass
+
+
+image_cache = ImageCache()
+
+
+def cache_images(max_bytes=64 * 1024 * 1024, directory=None, disk_bytes=256 * 1024 * 1024):
+    """
+    Sets up the cache of decoded images used by load_img and load_anim.
+    This forgets every image cached so far.
+
+    PARAMS/RETURN
+
+    max_bytes: Most bytes of decoded pixels kept in memory. Use 0 to turn the
+    memory cache off.
+
+    directory: Optional directory where decoded images are also saved, so
+    they are loaded quickly by the next run of the program too
+
+    disk_bytes: Most bytes kept in the directory
+
+    returns: nothing
+
+    EXAMPLE USES
+
+    from CSEPixelArt import *
+
+    # keep decoded images in the "cache" directory between runs
+    cache_images(directory="cache")
+
+    """
+    global image_cache
+    image_cache = ImageCache(max_bytes, directory, disk_bytes)
+
+
+# header of a binary PPM file with 8 bit samples: width, height, maximum
+PPM_HEADER = re.compile(rb'P6\s+(\d+)\s+(\d+)\s+(255)\s')
+
+
+def map_rgb(filename):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Memory map the pixels of an uncompressed binary PPM or 24 bit BMP file as
+    a read-only height by width by 3 Numpy array. Returns None for any other
+    kind of file.
+    """
+    with open(filename, 'rb') as image_file:
+        head = image_file.read(54)
+
+    match = PPM_HEADER.match(head)
+    if match:
+        (width, height) = (int(match.group(1)), int(match.group(2)))
+        return np.memmap(filename, dtype=np.uint8, mode='r', offset=match.end(), shape=(height, width, 3))
+
+    if head[:2] == b'BM' and len(head) == 54:
+        (offset,) = struct.unpack_from('<I', head, 10)
+        (width, height, planes, bits, compression) = struct.unpack_from('<iiHHI', head, 18)
+        if bits != 24 or compression != 0 or width <= 0 or height == 0:
+            return None
+        # rows are padded to 4 bytes, stored bottom up unless height is
+        # negative, and pixels are in BGR order
+        stride = (width * 3 + 3) & ~3
+        rows = np.memmap(filename, dtype=np.uint8, mode='r', offset=offset, shape=(abs(height), stride))
+        pixels = rows[:, :width * 3].reshape(abs(height), width, 3)[:, :, ::-1]
+        return pixels[::-1] if height > 0 else pixels
+
+    return None
 
 
 def pixart_to_pil(img, scale=1):
     """
     THIS IS A PRIVATE FUNCTION: no need to use this function from the outside    
 
-    Convert an image in CSEPixelArt library format (which is a list of lists of
-    pixels) to a Pillow image. This only supports scaling up (ie: scale >= 1).
+    Convert an image in CSEPixelArt library format (a PixelImage or a list of
+    lists of pixels) to a Pillow image. This only supports scaling up (ie:
+    scale >= 1). A PixelImage is read through its array interface, so its
+    pixels are not converted again.
     """
     arr = np.asarray(img, dtype=np.uint8)
     pil_img = Image.fromarray(arr)
@@ -244,17 +606,47 @@ def save_img(img, filename, scale=1):
     returns: nothing
 
     """
-    if get_height(img) * scale > 1000:
-        print("WARNING: the height will be larger than 1000 pixels")
-        print("This is unusual for this Pixel Art competition so it may be a bug")
-    if get_width(img) * scale > 1000:
-        print("WARNING: the width will be larger than 1000 pixels")
-        print("This is unusual for this Pixel Art competition so it may be a bug")
+    check_size(img, scale)
     pil_img = pixart_to_pil(img, scale)
     pil_img.save(filename, format='png')
 
 
-def save_anim(images, filename, scale=1, duration=100, comment=None):
+def export_img(img, outputs):
+    """
+    Save the provided image to several PNG files at different scales. The
+    image is converted once and the files are written at the same time.
+
+    PARAMS/RETURN
+
+    img: Image to save, in the CSEPixelArt image format
+
+    outputs: The files to write, either a dictionary from scale to file name
+    or a list of (scale, file name) pairs. See save_img for scales and file
+    names.
+
+    returns: nothing
+
+    EXAMPLE USES
+
+    from CSEPixelArt import *
+
+    # save the image as it is and 10 times larger
+    export_img(img, {1: "art.png", 10: "art_large.png"})
+
+    """
+    outputs = output_list(outputs)
+    check_size(img, max(scale for (scale, filename) in outputs))
+    pixels = np.asarray(img, dtype=np.uint8)
+
+    def save(output):
+        (scale, filename) = output
+        Image.fromarray(scale_up(pixels, scale)).save(filename, format='png')
+
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        list(executor.map(save, outputs))
+
+
+def save_anim(images, filename, scale=1, duration=100, comment=None, palette=None, delta=True):
     """
     Save the provided animation to an animated GIF format.
 
@@ -277,24 +669,415 @@ def save_anim(images, filename, scale=1, duration=100, comment=None):
     is 1.
 
     duration: Optional pause between frames, in milliseconds. The default is
-    100.
+    100. It can also be a list with one duration per frame.
 
     comment: Optional text comment to embed in GIF file
 
+    palette: Optional list of up to 256 colors (tuples of 3 integers) used for
+    every frame. Pixels of other colors are drawn with the closest palette
+    color. If palette is None, one palette is worked out for the whole
+    animation: the exact colors if there are no more than 256, otherwise the
+    best 256 for all the frames together.
+
+    delta: Optional, if True (the default) each frame after the first only
+    stores the rectangle that changed since the previous frame, with the
+    unchanged pixels inside it left transparent when that helps. This makes
+    animations where little moves between frames much smaller. Use False to
+    store every frame whole.
+
+    Runs of identical frames, such as the same image appended several times,
+    are stored once and shown for the sum of their durations.
+
+    Instead of a list, images can be any iterable of frames, for example a
+    generator. Each frame is then encoded as it is produced, so very long
+    animations don't need to fit in memory. Without a palette the colors
+    are collected as frames arrive, and the encoded frames wait in a
+    temporary file until the color table can be written. Once a frame brings
+    more colors than the 255 that fit, the rest of the table is filled by
+    quantizing that frame, and every later frame gets the closest colors of
+    the table. Streaming many-colored frames is therefore best done with a
+    palette worked out beforehand, or from a list.
+
+    returns: nothing
+    """
+    export_anim(images, [(scale, filename)], duration, comment, palette, delta)
+
+
+def export_anim(images, outputs, duration=100, comment=None, palette=None, delta=True):
+    """
+    Save the provided animation to several animated GIF files at different
+    scales. Each frame is converted to the palette once, the larger scales
+    are made by repeating its pixels, and the files are encoded at the same
+    time.
+
+    PARAMS/RETURN
+
+    images: Animation to save, a list (or any iterable) of frames in the
+    CSEPixelArt image format
+
+    outputs: The files to write, either a dictionary from scale to file name
+    or a list of (scale, file name) pairs
+
+    duration, comment, palette, delta: see save_anim
+
     returns: nothing
+
+    EXAMPLE USES
+
+    from CSEPixelArt import *
+
+    # save the animation as it is and 5 times larger
+    export_anim(images, {1: "art.gif", 5: "art_large.gif"})
+
+    """
+    outputs = output_list(outputs)
+    frames = merge_repeats(timed_frames(images, duration), max(scale for (scale, filename) in outputs),
+                           isinstance(images, (list, tuple)))
+
+    if palette is not None:
+        gif_palette = GifPalette(palette)
+    elif isinstance(images, (list, tuple, np.ndarray)):
+        # all the frames are at hand, so the palette can be worked out first
+        with profiling.stage('palette'):
+            frames = list(frames)
+            if not frames:
+                raise ValueError("There are no frames to save")
+            gif_palette = GifPalette.for_frames([frame for (frame, frame_duration) in frames])
+    else:
+        gif_palette = GifPalette.collecting()
+
+    # a palette entry, if there is room, for unchanged pixels
+    transparency = None
+    if delta and gif_palette.max_colors < 256:
+        transparency = gif_palette.max_colors
+    elif delta and len(gif_palette.colors) < 256:
+        transparency = len(gif_palette.colors)
+
+    def add_frame(scale, writer, pixels, frame_duration, offset, disposal, transparency):
+        writer.add_frame(scale_up(pixels, scale), frame_duration,
+                         (offset[0] * scale, offset[1] * scale), disposal, transparency)
+
+    writers = []
+    previous = None
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        try:
+            for (frame, frame_duration) in frames:
+                if not writers:
+                    (height, width) = frame.shape[:2]
+                    writers = [(scale, GifWriter(filename, width * scale, height * scale, comment=comment))
+                               for (scale, filename) in outputs]
+                    if not gif_palette.growing:
+                        for (scale, writer) in writers:
+                            writer.start(gif_palette.table(transparency))
+
+                with profiling.stage('palette index'):
+                    pixels = gif_palette.index(frame)
+                with profiling.stage('delta'):
+                    if delta and previous is not None:
+                        (offset, patch) = frame_delta(previous, pixels, transparency)
+                        frame_args = (patch, frame_duration, offset, 1, transparency)
+                    else:
+                        frame_args = (pixels, frame_duration, (0, 0), 1 if delta else 0, None)
+                # every file gets this frame before any file gets the next
+                with profiling.stage('encode'):
+                    futures = [executor.submit(add_frame, scale, writer, *frame_args) for (scale, writer) in writers]
+                    for future in futures:
+                        future.result()
+                previous = pixels
+        finally:
+            for (scale, writer) in writers:
+                writer.close(gif_palette.table(transparency))
+
+    if not writers:
+        raise ValueError("There are no frames to save")
+
+
+def timed_frames(images, duration, frame_limit=60):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Generate (image, duration) for each image, warning once the animation
+    goes over the frame limit of the competition
+    """
+    durations = duration if isinstance(duration, (list, tuple)) else None
+    count = 0
+    for img in images:
+        if durations is not None and count >= len(durations):
+            raise ValueError("There must be one duration per frame")
+        yield (img, duration if durations is None else durations[count])
+        count += 1
+        if count == frame_limit + 1:
+            print("WARNING: the CSE Pixel Art Competition has a limit of " + str(frame_limit) + " frames")
+
+    if count > frame_limit:
+        print("Your animation has " + str(count) + " frames")
+    if durations is not None and count != len(durations):
+        raise ValueError("There must be one duration per frame")
+
+
+def output_list(outputs):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Turn a dictionary from scale to file name into a list of pairs
+    """
+    if isinstance(outputs, dict):
+        return list(outputs.items())
+    return list(outputs)
+
+
+def check_size(img, scale):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Warn about images that will be unusually large once scaled
     """
-    if len(images) > 60:
-        print("WARNING: the CSE Pixel Art Competition has a limit of 60 frames")
-        print("Your animation has " + str(len(images)) + " frames")
-    if get_height(images[0]) * scale > 1000:
+    if get_height(img) * scale > 1000:
         print("WARNING: the height will be larger than 1000 pixels")
         print("This is unusual for this Pixel Art competition so it may be a bug")
-    if get_width(images[0]) * scale > 1000:
+    if get_width(img) * scale > 1000:
         print("WARNING: the width will be larger than 1000 pixels")
         print("This is unusual for this Pixel Art competition so it may be a bug")
 
-    pil_images = [pixart_to_pil(x, scale).convert("P", palette=Image.ADAPTIVE) for x in images]
-    if comment:
-        pil_images[0].info['comment'] = comment
-    pil_images[0].save(filename, format='gif',
-                       save_all=True, append_images=pil_images[1:], optimize=False, duration=duration, loop=0)
+
+def merge_repeats(timed_images, scale=1, same_objects=False):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Generate (array, duration) frames from (image, duration) pairs, merging
+    each run of identical images into one frame that lasts the sum of their
+    durations. The size of the first frame is checked at the given scale.
+
+    Each frame is copied, as a generator may fill the same array again for
+    the next frame. Only if same_objects is True (the images come from a
+    list) is the same object again taken as a repeat without comparing it.
+    """
+    frame = None
+    frame_duration = 0
+    previous = None
+    for (img, duration) in timed_images:
+        if same_objects and frame is not None and img is previous:
+            frame_duration += duration
+            continue
+        pixels = np.array(img, dtype=np.uint8)
+        if frame is None:
+            check_size(pixels, scale)
+        elif np.array_equal(pixels, frame):
+            frame_duration += duration
+            continue
+        else:
+            yield (frame, frame_duration)
+        (frame, frame_duration, previous) = (pixels, duration, img)
+
+    if frame is not None:
+        yield (frame, frame_duration)
+
+
+def frame_delta(previous, pixels, transparency=None):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Return the offset (left, top) and the pixels of the smallest rectangle
+    holding every pixel that differs from the previous frame. If there is a
+    transparency index and most of the rectangle is unchanged, the unchanged
+    pixels inside it are set to the transparency index.
+    """
+    changed = previous != pixels
+    rows = np.flatnonzero(changed.any(axis=1))
+    if len(rows) == 0:
+        # nothing changed, redraw a single pixel
+        return ((0, 0), pixels[:1, :1])
+    cols = np.flatnonzero(changed.any(axis=0))
+    (top, bottom, left, right) = (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+
+    patch = pixels[top:bottom, left:right]
+    changed = changed[top:bottom, left:right]
+    # a few scattered transparent pixels compress worse than the real ones,
+    # so only mask rectangles that mostly stayed the same
+    if transparency is not None and changed.mean() <= 0.25:
+        patch = np.where(changed, patch, transparency).astype(np.uint8)
+    return ((int(left), int(top)), patch)
+
+
+def scale_up(pixels, scale):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Turn every pixel of a 2D array into a scale by scale block
+    """
+    if scale > 1:
+        pixels = pixels.repeat(scale, axis=0).repeat(scale, axis=1)
+    return pixels
+
+
+def color_keys(pixels):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Pack the pixels of a height by width by 3 array into one integer each
+    """
+    pixels = pixels.astype(np.uint32)
+    return (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+
+class GifPalette:
+    """
+    THIS IS A PRIVATE CLASS: no need to use this class from the outside
+
+    Up to 256 colors shared by every frame of an animation, and the lookup
+    from pixel colors to palette indices. A growing palette adds the new
+    colors of each frame it indexes until it is full, without changing the
+    index of any color already in it.
+    """
+
+    def __init__(self, colors, growing=False, max_colors=256):
+        self.growing = growing
+        self.max_colors = max_colors
+        self.set_colors(np.asarray(colors, dtype=np.uint8).reshape(-1, 3)[:max_colors])
+
+    def set_colors(self, colors):
+        self.colors = colors
+        keys = color_keys(colors)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    @classmethod
+    def for_frames(cls, frames, max_colors=256):
+        """the exact colors of the frames if they fit, otherwise one median
+        cut quantization over all of the frames together"""
+        keys = np.unique(np.concatenate([np.unique(color_keys(frame)) for frame in frames]))
+        if len(keys) <= max_colors:
+            return cls(unpack_keys(keys))
+
+        return cls(median_cut(np.concatenate([frame.reshape(-1, 3) for frame in frames]), max_colors))
+
+    @classmethod
+    def collecting(cls, max_colors=255):
+        """an empty palette that grows as frames are indexed"""
+        return cls(np.zeros((0, 3)), growing=True, max_colors=max_colors)
+
+    def table(self, transparency=None):
+        """the colors to write as the color table"""
+        size = len(self.colors) if transparency is None else max(len(self.colors), transparency + 1)
+        colors = np.zeros((max(size, 1), 3), dtype=np.uint8)
+        colors[:len(self.colors)] = self.colors
+        return colors
+
+    def index(self, frame):
+        """the palette index of every pixel of a height by width by 3 frame"""
+        (keys, inverse) = np.unique(color_keys(frame), return_inverse=True)
+        position = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        missing = self.keys[position] != keys if len(self.keys) else np.ones(len(keys), dtype=bool)
+
+        room = self.max_colors - len(self.colors)
+        if self.growing and missing.any() and room > 0:
+            if missing.sum() <= room:
+                new_colors = unpack_keys(keys[missing])
+            else:
+                # too many new colors: the room left goes to a median cut
+                # of the pixels that have them
+                new_colors = median_cut(frame.reshape(-1, 3)[missing[inverse.reshape(-1)]], room)
+            self.set_colors(np.concatenate([self.colors, new_colors]))
+            return self.index(frame)
+
+        lookup = self.order[position]
+        # colors missing from the palette get the closest palette color
+        if missing.any():
+            lookup[missing] = self.nearest(unpack_keys(keys[missing]))
+
+        return lookup.astype(np.uint8)[inverse].reshape(frame.shape[:2])
+
+    def nearest(self, colors):
+        """the index of the closest palette color to each of an array of
+        (r, g, b) colors, found by Pillow one row of colors at a time"""
+        palette_img = Image.new('P', (1, 1))
+        palette_img.putpalette(self.colors.tobytes())
+        strip = Image.fromarray(np.ascontiguousarray(colors, dtype=np.uint8).reshape(1, -1, 3))
+        return np.asarray(strip.quantize(palette=palette_img, dither=Image.Dither.NONE)).reshape(-1)
+
+
+def median_cut(pixels, max_colors):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Returns at most max_colors (r, g, b) colors for an array of pixels,
+    found by median cut quantization of a sample of about a million pixels
+    """
+    pixels = pixels[::max(1, len(pixels) // (1 << 20))]
+    sample = Image.fromarray(np.ascontiguousarray(pixels, dtype=np.uint8).reshape(-1, 1, 3))
+    quantized = sample.quantize(max_colors, method=Image.Quantize.MEDIANCUT)
+    return np.asarray(quantized.getpalette()[:max_colors * 3], dtype=np.uint8).reshape(-1, 3)
+
+
+def unpack_keys(keys):
+    """
+    THIS IS A PRIVATE FUNCTION: no need to use this function from the outside
+
+    Turn packed color keys back into an array of (r, g, b) colors
+    """
+    return (np.stack([keys >> 16, keys >> 8, keys], axis=1) & 0xff).astype(np.uint8)
+
+
+class GifWriter:
+    """
+    THIS IS A PRIVATE CLASS: no need to use this class from the outside
+
+    Writes an animated GIF frame by frame with a single global color table.
+    Frames are 2D arrays of palette indices. Pillow does the LZW encoding of
+    each frame. Frames added before the color table is known are kept in a
+    temporary file until start is called.
+    """
+
+    def __init__(self, filename, width, height, loop=0, comment=None):
+        self.file = open(filename, 'wb')
+        self.width = width
+        self.height = height
+        self.loop = loop
+        self.comment = comment
+        self.out = None
+
+    def start(self, colors):
+        """writes the header and color table, then any frames waiting"""
+        # the color table size is a power of 2, at least 2 entries
+        bits = max(1, int(len(colors) - 1).bit_length())
+        table = bytearray(3 << bits)
+        table[:3 * len(colors)] = np.asarray(colors, dtype=np.uint8).tobytes()
+
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', self.width, self.height, 0xf0 | (bits - 1), 0, 0) + table)
+        # loop count
+        self.file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+        if self.comment:
+            data = self.comment.encode() if isinstance(self.comment, str) else self.comment
+            self.file.write(b'!\xfe')
+            for i in range(0, len(data), 255):
+                self.file.write(bytes([len(data[i:i + 255])]) + data[i:i + 255])
+            self.file.write(b'\x00')
+
+        if self.out is not None:
+            self.out.seek(0)
+            shutil.copyfileobj(self.out, self.file)
+            self.out.close()
+        self.out = self.file
+
+    def add_frame(self, pixels, duration, offset=(0, 0), disposal=0, transparency=None):
+        if self.out is None:
+            self.out = tempfile.TemporaryFile()
+        params = {'duration': duration, 'disposal': disposal}
+        if transparency is not None:
+            params['transparency'] = transparency
+        frame = Image.fromarray(np.ascontiguousarray(pixels, dtype=np.uint8))
+        for data in GifImagePlugin.getdata(frame, offset, **params):
+            self.out.write(data)
+
+    def close(self, colors=None):
+        """finishes the file, starting it with colors if not started yet"""
+        if self.out is not self.file:
+            self.start(colors)
+        self.file.write(b';')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
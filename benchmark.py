@@ -0,0 +1,267 @@
+# Benchmarks for the simulation, RLE, image conversion and GIF export code
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+from PIL import Image
+
+import conway
+import puzzle
+import rle2img
+from CSEPixelArt import pil_to_pixart, pixart_to_pil, save_anim
+
+SIZES = [32, 256, 1024, 4096]
+
+# the loop engine takes seconds per generation past this size
+LOOP_MAX_SIZE = 256
+
+# animations are benchmarked up to this size, as a few frames of this size
+# already take hundreds of megabytes
+ANIM_MAX_SIZE = 1024
+ANIM_FRAMES = 16
+
+# the example files are next to this script
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# ratio over the baseline time counted as a regression
+THRESHOLD = 0.1
+
+
+def write_rle(cells, filename):
+    """writes a 2D bool array as an RLE pattern file"""
+    runs = []
+    for row in np.asarray(cells, dtype=bool):
+        # starts of the runs of equal cells along the row
+        starts = np.flatnonzero(np.diff(row.astype(np.int8), prepend=-1))
+        lengths = np.diff(starts, append=len(row))
+        for (start, length) in zip(starts, lengths):
+            if row[start] or start + length < len(row):
+                runs.append((str(length) if length > 1 else '') + ('o' if row[start] else 'b'))
+        runs.append('$')
+    body = ''.join(runs[:-1]) + '!'
+    with open(filename, 'w') as rle_file:
+        rle_file.write('x = %d, y = %d, rule = B3/S23\n' % (cells.shape[1], cells.shape[0]))
+        # lines of at most 70 characters like other RLE writers
+        for i in range(0, len(body), 70):
+            rle_file.write(body[i:i + 70] + '\n')
+
+
+def soup(size, density=0.2, seed=0):
+    """returns a size by size grid of random cells"""
+    return np.random.default_rng(seed).random((size, size)) < density
+
+
+def read_all_sequences(source):
+    rle = rle2img.RLE(source)
+    while rle.next_sequence()[0] != '!':
+        pass
+
+
+def sparse_state(start):
+    grid = start.copy()
+    return (conway.make_engine('sparse', grid), grid)
+
+
+def update_workload(update, size):
+    # every generation is stepped from the same soup
+    start = soup(size)
+    return (lambda grid: update(0, grid, size, 2), lambda: (start.copy(),))
+
+
+def sparse_workload(size):
+    start = soup(size)
+    return (lambda step, grid: step(0, grid, size, 2), lambda: sparse_state(start))
+
+
+def soup_rle(size, directory):
+    """returns the RLE file of the soup of a size, writing it the first time"""
+    source = os.path.join(directory, 'soup%d.rle' % size)
+    if not os.path.exists(source):
+        write_rle(soup(size), source)
+    return source
+
+
+def rle_workload(kind, source, target):
+    if kind == 'rle.next_sequence':
+        return (lambda: read_all_sequences(source), None)
+    if kind == 'rle.to_array':
+        return (lambda: rle2img.RLE(source).to_array(), None)
+    if kind == 'conway.add_rle':
+        (x, y) = rle2img.RLE(source).dimensions
+        grid = np.zeros((max(x, y), max(x, y)), dtype=bool)
+        return (lambda: conway.add_rle(source, grid), None)
+    return (lambda: rle2img.make_image(source, target, 1), None)
+
+
+def image_workload(kind, size, as_array=False):
+    pixels = np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8)
+    pil_img = Image.fromarray(pixels)
+    if kind == 'pil_to_pixart':
+        return (lambda: pil_to_pixart(pil_img, as_array=as_array), None)
+    img = pil_to_pixart(pil_img)
+    return (lambda: pixart_to_pil(img), None)
+
+
+def anim_workload(size, directory):
+    # a soup over the scrolling background, like conway makes
+    background = conway.load_img(os.path.join(HERE, 'background.gif'), as_array=True)
+    frames = conway.scrolled_backgrounds(background, ANIM_FRAMES, size, size)
+    grid = soup(size)
+    for frame in range(ANIM_FRAMES):
+        conway.paint_cells(frames[frame], grid, (202, 44, 146))
+        conway.update_numpy(frame, grid, size, 2)
+    target = os.path.join(directory, 'anim%d.gif' % size)
+    return (lambda: save_anim(frames, target), None)
+
+
+def puzzle_workload():
+    # encode_message changes the rows of its input, so each call gets a copy
+    qr_image = puzzle.qr_to_image(puzzle.segno.make(12))
+    return (lambda image: puzzle.encode_message(image, 'HI'), lambda: ([list(row) for row in qr_image],))
+
+
+def workloads(sizes, directory):
+    """generates (name, params, prepare) for every benchmark. prepare()
+    makes the inputs of the benchmark and returns (function, setup). If
+    setup isn't None, each call is function(*setup()), only function being
+    timed, for work that changes the state it is given. Inputs are only
+    made for the benchmarks that are run."""
+    for size in sizes:
+        for (engine, update) in conway.ENGINES.items():
+            if engine == 'loop' and size > LOOP_MAX_SIZE:
+                continue
+            yield ('conway.update', {'engine': engine, 'size': size},
+                   lambda update=update, size=size: update_workload(update, size))
+        yield ('conway.update', {'engine': 'sparse', 'size': size}, lambda size=size: sparse_workload(size))
+
+    # functions returning the RLE file of each pattern
+    patterns = [('coeship', lambda: os.path.join(HERE, 'coeship.rle'))] + \
+        [('soup%d' % size, lambda size=size: soup_rle(size, directory)) for size in sizes]
+    for (pattern, source) in patterns:
+        target = os.path.join(directory, pattern + '.png')
+        for kind in ('rle.next_sequence', 'rle.to_array', 'conway.add_rle', 'rle2img.make_image'):
+            yield (kind, {'pattern': pattern},
+                   lambda kind=kind, source=source, target=target: rle_workload(kind, source(), target))
+
+    for size in sizes:
+        yield ('pil_to_pixart', {'size': size}, lambda size=size: image_workload('pil_to_pixart', size))
+        yield ('pil_to_pixart', {'size': size, 'as_array': True},
+               lambda size=size: image_workload('pil_to_pixart', size, as_array=True))
+        yield ('pixart_to_pil', {'size': size}, lambda size=size: image_workload('pixart_to_pil', size))
+
+    for size in sizes:
+        if size <= ANIM_MAX_SIZE:
+            yield ('save_anim', {'size': size, 'frames': ANIM_FRAMES}, lambda size=size: anim_workload(size, directory))
+
+    yield ('puzzle.encode_message', {'length': 2}, puzzle_workload)
+
+
+def benchmark_id(name, params):
+    return name + '[' + ','.join('%s=%s' % item for item in sorted(params.items())) + ']'
+
+
+def timed_calls(function, setup, number):
+    """returns the seconds taken by number calls of function(*setup()),
+    leaving out the time of setup"""
+    elapsed = 0.0
+    for i in range(number):
+        args = setup()
+        start = time.perf_counter()
+        function(*args)
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def measure(function, repeat, setup=None):
+    """returns the best and median seconds per call over repeat runs, each
+    run calling function enough times to take at least 0.2 seconds"""
+    if setup is None:
+        timer = timeit.Timer(function)
+        (number, elapsed) = timer.autorange()
+        times = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+    else:
+        number = 1
+        while timed_calls(function, setup, number) < 0.2:
+            number *= 2
+        times = [timed_calls(function, setup, number) / number for i in range(repeat)]
+    times.sort()
+    return (number, times[0], times[len(times) // 2])
+
+
+def run(sizes, repeat, pattern=None):
+    """runs the benchmarks whose id contains pattern, printing each result
+    as it is measured, and returns the results"""
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for (name, params, prepare) in workloads(sizes, directory):
+            key = benchmark_id(name, params)
+            if pattern and pattern not in key:
+                continue
+            (function, setup) = prepare()
+            (number, best, median) = measure(function, repeat, setup)
+            results.append({'id': key, 'name': name, 'params': params,
+                            'best': best, 'median': median, 'number': number, 'repeat': repeat})
+            print(f'{key:60s} {best * 1000:12.3f} ms', file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """prints the change of every benchmark against the baseline and returns
+    the ids of those more than threshold slower"""
+    before = {result['id']: result for result in baseline['results']}
+    regressions = []
+    print(f'{"benchmark":60s} {"baseline ms":>12s} {"ms":>12s} {"change":>8s}')
+    for result in results:
+        old = before.get(result['id'])
+        if old is None:
+            continue
+        change = result['best'] / old['best'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(result['id'])
+            flag = '  SLOWER'
+        print(f'{result["id"]:60s} {old["best"] * 1000:12.3f} {result["best"] * 1000:12.3f} {change:+8.1%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the simulation, RLE, image conversion and GIF export code.")
+
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--repeat', dest='repeat', type=int, default=5)
+    parser.add_argument('--filter', dest='filter', required=False)
+    parser.add_argument('--output', dest='output', required=False)
+    parser.add_argument('--compare', dest='compare', required=False)
+    parser.add_argument('--threshold', dest='threshold', type=float, default=THRESHOLD)
+
+    args = parser.parse_args()
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'results': run(args.sizes, args.repeat, args.filter),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(report['results'], baseline, args.threshold)
+        if regressions:
+            exit(f'{len(regressions)} benchmarks are more than {args.threshold:.0%} slower than the baseline.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# Bit-packed Game of Life board for very large grids
+import numpy as np
+
+WORD_BITS = 64
+
+ONE = np.uint64(1)
+TOP_BIT = np.uint64(WORD_BITS - 1)
+
+# rows processed together in one step, bounds the temporary arrays
+CHUNK_ROWS = 1024
+
+
+class BitBoard:
+    """
+    A toroidal Game of Life board stored one bit per cell.
+
+    Each row is packed into uint64 words, column j being bit j % 64 of word
+    j // 64. Bits past the width in the last word of a row are always zero.
+    """
+
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.words = np.zeros((height, (width + WORD_BITS - 1) // WORD_BITS), dtype=np.uint64)
+
+    @classmethod
+    def from_grid(cls, grid):
+        """returns a board holding the cells of a 2D bool grid"""
+        (height, width) = grid.shape
+        board = cls(height, width)
+        packed = np.packbits(np.asarray(grid, dtype=bool), axis=1, bitorder='little')
+        padded = np.zeros((height, board.words.shape[1] * 8), dtype=np.uint8)
+        padded[:, :packed.shape[1]] = packed
+        board.words[:] = padded.view('<u8')
+        return board
+
+    def to_grid(self, out=None):
+        """returns the cells as a 2D bool grid, filling out if given"""
+        packed = self.words.astype('<u8').view(np.uint8)
+        cells = np.unpackbits(packed, axis=1, count=self.width, bitorder='little').view(bool)
+        if out is None:
+            return cells
+        out[:] = cells
+        return out
+
+    def population(self):
+        """returns the number of live cells"""
+        return int(np.unpackbits(self.words.view(np.uint8)).sum())
+
+    def _last_bit(self):
+        return np.uint64((self.width - 1) % WORD_BITS)
+
+    def _mask_last_word(self, words):
+        remainder = self.width % WORD_BITS
+        if remainder:
+            words[:, -1] &= np.uint64((1 << remainder) - 1)
+        return words
+
+    def _east(self, words):
+        """every cell takes the value of its west neighbor"""
+        shifted = words << ONE
+        shifted[:, 1:] |= words[:, :-1] >> TOP_BIT
+        shifted[:, 0] |= (words[:, -1] >> self._last_bit()) & ONE
+        return self._mask_last_word(shifted)
+
+    def _west(self, words):
+        """every cell takes the value of its east neighbor"""
+        shifted = words >> ONE
+        shifted[:, :-1] |= words[:, 1:] << TOP_BIT
+        shifted[:, -1] |= (words[:, 0] & ONE) << self._last_bit()
+        return shifted
+
+    def _next_rows(self, rows):
+        """applies B3/S23 to the inner rows of a block that carries one halo
+        row above and below"""
+        up = rows[:-2]
+        alive = rows[1:-1]
+        down = rows[2:]
+
+        neighbors = [up, self._east(up), self._west(up),
+                     self._east(alive), self._west(alive),
+                     down, self._east(down), self._west(down)]
+
+        # count neighbors modulo 8 in three bit planes with a ripple adder
+        s0 = np.zeros_like(alive)
+        s1 = np.zeros_like(alive)
+        s2 = np.zeros_like(alive)
+        for plane in neighbors:
+            carry = s0 & plane
+            s0 ^= plane
+            plane = s1 & carry
+            s1 ^= carry
+            s2 ^= plane
+
+        # 2 or 3 neighbors is 01x in (s2, s1, s0), 8 neighbors wraps to 000
+        return s1 & ~s2 & (s0 | alive)
+
+    def shift(self, x_offset):
+        """moves every cell x_offset columns east, wrapping around"""
+        x_offset %= self.width
+        if x_offset <= self.width // 2:
+            for i in range(x_offset):
+                self.words = self._east(self.words)
+        else:
+            for i in range(self.width - x_offset):
+                self.words = self._west(self.words)
+
+    def step(self, x_offset=0):
+        """advances one generation, then shifts the board x_offset columns"""
+        new_words = np.empty_like(self.words)
+        for start in range(0, self.height, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, self.height)
+            # block with the wrapped row above and below it
+            rows = np.take(self.words, range(start - 1, stop + 1), axis=0, mode='wrap')
+            new_words[start:stop] = self._next_rows(rows)
+        self.words = new_words
+
+        if x_offset:
+            self.shift(x_offset)
@@ -1,11 +1,23 @@
 # Python code to implement Conway's Game Of Life
 import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 
 # setting up the values for the grid
-from CSEPixelArt import load_img, save_anim
-from rle2img import RLE
+from bitboard import BitBoard
+from CSEPixelArt import cache_images, export_anim, load_img
+from hashlife import HashLife
+from parallel import ParallelLife
+import profiling
+from rle2img import RLE, PatternCache, read_pattern
+from sparse import SparseLife
 
 COMMENT = 'Created for UCSD CSE Pixel Art Competition 2021\n' + \
           'https://pixel-art.goto.ucsd.edu/\n' + \
@@ -24,9 +36,10 @@ OFF = False
 values = [ON, OFF]
 
 
-def random_grid(grid_size):
-    """returns a grid of NxN random values"""
-    return np.random.choice(values, grid_size * grid_size, p=[0.2, 0.8]).reshape(grid_size, grid_size)
+def random_grid(grid_size, seed=None):
+    """returns a grid of NxN random values, the same grid every time for
+    a given seed"""
+    return np.random.default_rng(seed).random((grid_size, grid_size)) < 0.2
 
 
 def add_glider(i, j, grid):
@@ -67,30 +80,60 @@ def add_gosper_glider_gun(i, j, grid):
     grid[i:i + 11, j:j + 38] = gun
 
 
-def add_rle(source, grid):
-    rle = RLE(source)
-    (x, y) = rle.dimensions
+def add_cells(cells, top, left, grid):
+    """adds a pattern with top left cell at (top, left), leaving out
+    the parts that fall outside the grid"""
+    (height, width) = cells.shape
+    (top_clip, left_clip) = (max(-top, 0), max(-left, 0))
+    bottom = min(top + height, grid.shape[0])
+    right = min(left + width, grid.shape[1])
+    if bottom > top + top_clip and right > left + left_clip:
+        grid[top + top_clip:bottom, left + left_clip:right] |= \
+            cells[top_clip:bottom - top, left_clip:right - left]
+
 
-    if len(grid) < max(x, y):
-        raise IndexError
+def add_rle(source, grid, cache=None):
+    """adds an RLE pattern in the middle of the grid, patterns larger than
+    the grid are clipped to its middle"""
+    cells = read_pattern(source, cache).cells
+    (y, x) = cells.shape
 
     offset_x = (len(grid) - x) // 2
     offset_y = (len(grid) - y) // 2
 
-    xp = 0
-    yp = 0
-    (symbol, length) = rle.next_sequence()
-    while symbol != '!':
-        if symbol == '$':
-            xp = 0
-            yp += 1
-        elif symbol == 'b':
-            xp += length
-        else:
-            for i in range(length):
-                grid[offset_y + yp, offset_x + xp + i] = ON
-            xp += length
-        (symbol, length) = rle.next_sequence()
+    add_cells(cells, offset_y, offset_x, grid)
+
+
+def scroll_offset(frame_number, rate):
+    """returns the horizontal shift applied to the grid after this frame"""
+    if rate > 0 and frame_number % rate == 0:
+        return -1
+    elif rate < 0:
+        return -rate
+    else:
+        return 0
+
+
+def total_offset(generations, rate):
+    """returns the horizontal shift the grid has after a number of generations"""
+    if rate > 0 and float(rate).is_integer():
+        # one column for every frame number divisible by the rate
+        return -((generations + int(rate) - 1) // int(rate))
+    return sum(scroll_offset(frame_number, rate) for frame_number in range(generations))
+
+
+def add_rle_generation(source, grid, generation, rate):
+    """adds the RLE pattern as it is after a number of generations, computed
+    with HashLife on an unbounded plane and scrolled like the grid"""
+    rle = RLE(source)
+    (x, y) = rle.dimensions
+
+    offset_x = (len(grid) - x) // 2 + int(total_offset(generation, rate))
+    offset_y = (len(grid) - y) // 2
+
+    life = HashLife.from_rle(rle)
+    life.advance(generation)
+    life.to_grid(grid, top=-offset_y, left=-offset_x)
 
 
 def update(frame_number, grid, grid_size, rate):
@@ -100,12 +143,7 @@ def update(frame_number, grid, grid_size, rate):
     # for calculation and we go line by line
 
     # scroll window
-    if rate > 0 and frame_number % rate == 0:
-        x_offset = -1
-    elif rate < 0:
-        x_offset = -rate
-    else:
-        x_offset = 0
+    x_offset = scroll_offset(frame_number, rate)
 
     new_grid = np.zeros((grid_size, grid_size), dtype=bool)
     for i in range(grid_size):
@@ -136,24 +174,284 @@ def update(frame_number, grid, grid_size, rate):
     grid[:] = new_grid[:]
 
 
-# main() function
-def main():
-    # Command line args are in sys.argv[1], sys.argv[2] ..
-    # sys.argv[0] is the script name itself and can be ignored
-    # parse arguments
+def neighbor_count(grid):
+    """returns the number of live neighbors of every cell, wrapping
+    around the edges of the grid. A stack of grids has the grids along
+    its first axis."""
+    cells = grid.astype(np.uint8)
+
+    # sum each column of three cells, then three of those columns side by side
+    vertical = cells + np.roll(cells, 1, axis=-2) + np.roll(cells, -1, axis=-2)
+    return vertical + np.roll(vertical, 1, axis=-1) + np.roll(vertical, -1, axis=-1) - cells
+
+
+def update_numpy(frame_number, grid, grid_size, rate):
+    """same generation step as update, computed on the whole array at once"""
+    x_offset = int(scroll_offset(frame_number, rate))
+
+    # apply Conway's rules
+    total = neighbor_count(grid)
+    new_grid = (total == 3) | (grid & (total == 2))
+
+    # scroll window, cells pushed off one edge come back on the other
+    if x_offset:
+        new_grid = np.roll(new_grid, x_offset, axis=1)
+
+    # update data
+    grid[:] = new_grid
+
+
+def update_bitboard(frame_number, grid, grid_size, rate):
+    """same generation step as update, computed on a bit-packed copy of
+    the grid"""
+    board = BitBoard.from_grid(grid)
+    board.step(int(scroll_offset(frame_number, rate)))
+    board.to_grid(out=grid)
+
+
+def sparse_engine(grid, **options):
+    """returns an update function that only recomputes the tiles of grid
+    around live cells"""
+    life = SparseLife(grid)
+
+    def update_sparse(frame_number, grid, grid_size, rate):
+        life.step(grid, int(scroll_offset(frame_number, rate)))
+
+    return update_sparse
+
+
+def parallel_engine(grid, workers=None, **options):
+    """returns an update function that steps strips of grid in worker
+    processes"""
+    life = ParallelLife(grid, workers)
+
+    def update_parallel(frame_number, grid, grid_size, rate):
+        life.step(grid, int(scroll_offset(frame_number, rate)))
+
+    return update_parallel
+
+
+ENGINES = {
+    'loop': update,
+    'numpy': update_numpy,
+    'bitboard': update_bitboard,
+}
+
+# engines that keep state about the grid between generations
+ENGINE_FACTORIES = {
+    'sparse': sparse_engine,
+    'parallel': parallel_engine,
+}
+
+
+def make_engine(name, grid, **options):
+    """returns the update function of the named engine for grid"""
+    if name in ENGINE_FACTORIES:
+        return ENGINE_FACTORIES[name](grid, **options)
+    return ENGINES[name]
+
+
+def scrolled_backgrounds(background, frames, height, width, rate=BACKGROUND_SCROLL_RATE):
+    """returns a frames x height x width x 3 stack holding the background
+    window of every frame, scrolling rate columns per frame and tiling the
+    background in both directions"""
+    background = np.asarray(background, dtype=np.uint8)
+    rows = np.arange(height) % background.shape[0]
+    cols = (np.arange(width) + rate * np.arange(frames)[:, None]) % background.shape[1]
+    return background[rows[None, :, None], cols[:, None, :]]
+
+
+def paint_cells(img, grid, color):
+    """colors the pixels of img under the live cells of grid"""
+    img[grid] = color
+    return img
+
+
+def state_digest(grid):
+    """returns a short digest of the cells of a grid"""
+    packed = np.packbits(np.asarray(grid, dtype=bool))
+    return hashlib.blake2b(packed.tobytes(), digest_size=16).digest()
+
+
+def loop_key(grid, frame_number, rate, background_width):
+    """returns what decides every later frame: the cells, the position of
+    the scrolling background and where the frame is in the grid scrolling.
+    Two frames with the same key start the same sequence of frames."""
+    if rate > 0 and float(rate).is_integer():
+        rate_phase = frame_number % int(rate)
+    elif rate > 0:
+        # fractional rates scroll unevenly, don't try to find their period
+        rate_phase = frame_number
+    else:
+        rate_phase = 0
+    return (state_digest(grid), BACKGROUND_SCROLL_RATE * frame_number % background_width, rate_phase)
+
+
+def setup_parser():
     parser = argparse.ArgumentParser(description="Runs Conway's Game of Life simulation.")
 
     # add arguments
     parser.add_argument('--grid-size', dest='grid_size', required=False)
     parser.add_argument('--pixel-art', dest='pixel_art', required=False)
     parser.add_argument('--glider', action='store_true', required=False)
+    parser.add_argument('--seed', dest='seed', type=int, required=False)
     parser.add_argument('--gosper', action='store_true', required=False)
     parser.add_argument('--rle', dest='rle', required=False)
+    parser.add_argument('--cache', dest='cache', required=False)
     parser.add_argument('--rate', dest='rate', required=False)
+    parser.add_argument('--generation', dest='generation', type=int, default=0, required=False)
     parser.add_argument('--ship-color', nargs='+', type=int)
+    parser.add_argument('--engine', choices=[*ENGINES, *ENGINE_FACTORIES], default='numpy', required=False)
+    parser.add_argument('--workers', dest='workers', type=int, required=False)
+    parser.add_argument('--verify', action='store_true', required=False)
+    parser.add_argument('--frames', dest='frames', type=int, default=NUMBER_OF_FRAMES, required=False)
+    parser.add_argument('--loop', action='store_true', required=False)
+    parser.add_argument('--profile', dest='profile', required=False)
+    parser.add_argument('--sweep', dest='sweep', required=False,
+                        help='CSV or JSON manifest of option combinations to render, '
+                             '--pixel-art is then the output directory')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=os.cpu_count(), required=False)
+    return parser
+
 
+# main() function
+def main():
+    # Command line args are in sys.argv[1], sys.argv[2] ..
+    # sys.argv[0] is the script name itself and can be ignored
+    # parse arguments
+    parser = setup_parser()
     args = parser.parse_args()
 
+    if args.sweep:
+        sweep(parser, args)
+        return
+
+    with profiling.profiled(args.profile):
+        render(args)
+
+
+def read_manifest(filename):
+    """returns the jobs of a CSV or JSON manifest, each a dictionary from
+    option name (as on the command line, without the dashes) to value"""
+    with open(filename, newline='') as manifest_file:
+        if filename.lower().endswith('.json'):
+            jobs = json.load(manifest_file)
+        else:
+            jobs = list(csv.DictReader(manifest_file))
+    jobs = [{key.strip().lstrip('-'): value for (key, value) in job.items() if value not in (None, '')}
+            for job in jobs]
+    # rows with every field empty are not jobs
+    return [job for job in jobs if job]
+
+
+def job_args(parser, defaults, job):
+    """returns the arguments of one job, the options of the command line
+    being the defaults of every job"""
+    argv = []
+    for (key, value) in job.items():
+        option = '--' + key.replace('_', '-')
+        if isinstance(value, bool) or str(value).lower() in ('true', 'false', 'yes', 'no'):
+            if value is True or str(value).lower() in ('true', 'yes'):
+                argv.append(option)
+        elif isinstance(value, list):
+            argv += [option] + [str(item) for item in value]
+        elif key.replace('_', '-') == 'ship-color':
+            argv += [option] + str(value).replace(',', ' ').split()
+        else:
+            argv += [option, str(value)]
+
+    args = parser.parse_args(argv, namespace=argparse.Namespace(**vars(defaults)))
+    args.sweep = None
+    args.profile = None
+
+    # outputs go to the sweep directory, named after the job if no name is given
+    name = job.get('pixel-art', job.get('pixel_art'))
+    if name is None:
+        pattern = 'glider' if args.glider else 'gosper' if args.gosper else \
+            os.path.splitext(os.path.basename(args.rle))[0] if args.rle else \
+            'random' if args.seed is None else f'seed{args.seed}'
+        name = f'{pattern}_{args.grid_size or 32}_rate{args.rate or 0}'
+        if args.ship_color:
+            name += '_' + ''.join('%02x' % channel for channel in args.ship_color)
+    args.pixel_art = os.path.join(defaults.pixel_art or '.', name)
+    return args
+
+
+# background shared by the jobs of a sweep, set in each worker process
+_background = None
+
+
+def _share_background(background):
+    global _background
+    _background = background
+
+
+def _render_job(args):
+    start = time.perf_counter()
+    loop = render(args, _background)
+    return (time.perf_counter() - start, loop)
+
+
+def sweep(parser, args):
+    """renders every job of the manifest on a pool of processes, then writes
+    the time each job took to sweep.json in the output directory"""
+    manifest = read_manifest(args.sweep)
+    jobs = [job_args(parser, args, job) for job in manifest]
+    directory = args.pixel_art or '.'
+
+    # jobs named after the same options are told apart by their number in
+    # the manifest, two jobs given the same name would overwrite each other
+    outputs = {}
+    for (i, job) in enumerate(jobs):
+        outputs.setdefault(job.pixel_art, []).append(i)
+    for (output, same) in outputs.items():
+        if len(same) == 1:
+            continue
+        if any({'pixel-art', 'pixel_art'} & set(manifest[i]) for i in same):
+            exit(f'{len(same)} jobs of the manifest write {output}.')
+        for i in same:
+            jobs[i].pixel_art += '_%d' % (i + 1)
+    os.makedirs(directory, exist_ok=True)
+
+    # decoded once here, each worker gets a copy when it starts
+    background = load_img("background.gif", as_array=True)
+
+    results = [None] * len(jobs)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=_share_background,
+                             initargs=(background,)) as executor:
+        futures = {executor.submit(_render_job, job): i for (i, job) in enumerate(jobs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            job = jobs[i]
+            result = {'pixel_art': job.pixel_art, 'rle': job.rle, 'grid_size': job.grid_size,
+                      'rate': job.rate, 'ship_color': job.ship_color, 'engine': job.engine}
+            try:
+                (seconds, loop) = future.result()
+                result.update(seconds=seconds, loop=loop)
+            except (Exception, SystemExit) as error:
+                result['error'] = str(error)
+                print('%s: %s' % (job.pixel_art, error), file=sys.stderr, flush=True)
+            results[i] = result
+    elapsed = time.perf_counter() - start
+
+    with open(os.path.join(directory, 'sweep.json'), 'w') as summary_file:
+        json.dump({'seconds': elapsed, 'jobs': results}, summary_file, indent=2)
+
+    print(f'{"output":40s} {"seconds":>8s} {"loop":>6s}')
+    for result in results:
+        status = result.get('error') or f'{result["seconds"]:8.2f} {result["loop"][1] if result["loop"] else "":>6}'
+        print(f'{os.path.basename(result["pixel_art"]):40s} {status}')
+    failures = sum('error' in result for result in results)
+    print(f'{len(jobs)} jobs, {failures} failed, {elapsed:.2f} seconds')
+    if failures:
+        exit(1)
+
+
+def render(args, background=None):
+    """makes the animation described by the command line arguments, over
+    the background if given, and returns its seamless loop as (first frame,
+    period) or None"""
     # set grid size
     grid_size = 32
     if args.grid_size and int(args.grid_size) > 8:
@@ -163,47 +461,80 @@ def main():
     if args.ship_color:
         ship_color = tuple(args.ship_color)
 
-    # check if "glider" demo flag is specified
-    grid = np.zeros((grid_size, grid_size), dtype=bool)
-    if args.glider:
-        add_glider(1, 1, grid)
-    elif args.gosper:
-        add_gosper_glider_gun(10, 10, grid)
-    elif args.rle:
-        add_rle(args.rle, grid)
-
-    else:  # populate grid with random on/off -
-        # more off than on
-        grid = random_grid(grid_size)
-
     # set image scrolling
     rate = 0
     if args.rate:
         rate = float(args.rate)
 
-    background = load_img("background.gif")
-    frames, rows, cols = (NUMBER_OF_FRAMES, grid_size, grid_size)
-    images = []
+    # check if "glider" demo flag is specified
+    with profiling.stage('pattern'):
+        grid = np.zeros((grid_size, grid_size), dtype=bool)
+        if args.glider:
+            add_glider(1, 1, grid)
+        elif args.gosper:
+            add_gosper_glider_gun(10, 10, grid)
+        elif args.rle and args.generation > 0:
+            add_rle_generation(args.rle, grid, args.generation, rate)
+        elif args.rle:
+            add_rle(args.rle, grid, PatternCache(args.cache) if args.cache else None)
+
+        else:  # populate grid with random on/off -
+            # more off than on
+            grid = random_grid(grid_size, args.seed)
+
+    step = make_engine(args.engine, grid, workers=args.workers)
+
+    with profiling.stage('background'):
+        if background is None:
+            if args.cache:
+                cache_images(directory=args.cache)
+            background = load_img("background.gif", as_array=True)
+        frames, rows, cols = (args.frames, grid_size, grid_size)
+        images = scrolled_backgrounds(background, frames, rows, cols)
+
+    # frame number at which each state was first seen
+    seen = {}
+    loop = None
 
     for frame in range(frames):
-        # Create the image with the scrolling background
-        img = [[background[row][(col + BACKGROUND_SCROLL_RATE * frame) % len(background[0])]
-                for col in range(grid_size)] for row in range(grid_size)]
+        # Stop simulating once a state comes back, the frames repeat from there
+        with profiling.stage('cycle check', frame=frame):
+            key = loop_key(grid, frame, rate, background.shape[1])
+        if key in seen:
+            loop = (seen[key], frame - seen[key])
+            break
+        seen[key] = frame
 
         # Add spaceship
-        for row in range(grid_size):
-            for col in range(grid_size):
-                if grid[row][col] == ON:
-                    img[row][col] = ship_color
-
-        # Add the frame to our list of images
-        images.append(img)
+        with profiling.stage('composite', frame=frame):
+            paint_cells(images[frame], grid, ship_color)
+
+        # Update Conway's Game of Life, checking the engine against the
+        # reference loop if requested
+        if args.verify:
+            with profiling.stage('verify', frame=frame):
+                expected = grid.copy()
+                update(frame, expected, grid_size, rate)
+        with profiling.stage('simulate', frame=frame):
+            step(frame, grid, grid_size, rate)
+        if args.verify and not np.array_equal(grid, expected):
+            exit(f'Engine {args.engine} differs from the loop engine after frame {frame}.')
+
+    if loop:
+        (start, period) = loop
+        print(f'The animation loops seamlessly every {period} frames from frame {start}')
+        if args.loop:
+            images = images[start:start + period]
+        else:
+            for frame in range(start + period, frames):
+                images[frame] = images[frame - period]
+    elif args.loop:
+        print(f'No seamless loop in the first {frames} frames')
 
-        # Update Conway's Game of Life
-        update(frame, grid, grid_size, rate)
+    with profiling.stage('export'):
+        export_anim(images, {1: args.pixel_art + GIF, 5: args.pixel_art + LARGE + GIF}, comment=COMMENT)
 
-    save_anim(images, args.pixel_art + GIF, scale=1, comment=COMMENT)
-    save_anim(images, args.pixel_art + LARGE + GIF, scale=5, comment=COMMENT)
+    return loop
 
 # call main
 if __name__ == '__main__':
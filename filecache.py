@@ -0,0 +1,87 @@
+# Directories of cache files, shared by the pattern cache and the image cache
+import hashlib
+import os
+import threading
+
+
+class FileCache:
+    """
+    A directory of cache entries, each a file named after a hash of its key.
+    Entries are written under a temporary name and then renamed, so readers
+    never see half an entry. When the directory grows past max_bytes the
+    least recently used entries are removed.
+
+    The size of the directory is counted once and then kept up to date as
+    entries are written, so the directory is only listed again when it goes
+    past max_bytes. Entries written by other processes are counted at that
+    point. Eviction goes down to LOW_WATER of max_bytes, so it doesn't run
+    again on the next write.
+    """
+    LOW_WATER = 0.75
+
+    def __init__(self, directory, max_bytes, extension):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        # bytes in the directory, None until it is first counted
+        self.total = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def entry(self, key):
+        """returns the path of the entry for a key string"""
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + self.extension)
+
+    def touch(self, entry):
+        """marks an entry that was just read as recently used"""
+        os.utime(entry)
+
+    def write(self, entry, write_entry):
+        """calls write_entry with the open entry file, then evicts if the
+        directory is too big"""
+        temporary = '%s.%d.%d.tmp' % (entry, os.getpid(), threading.get_ident())
+        try:
+            with open(temporary, 'wb') as entry_file:
+                write_entry(entry_file)
+            size = os.path.getsize(temporary)
+            try:
+                # an entry written again replaces the old one
+                size -= os.path.getsize(entry)
+            except OSError:
+                pass
+            os.replace(temporary, entry)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+        with self.lock:
+            if self.total is None:
+                self.evict()
+            else:
+                self.total += size
+                if self.total > self.max_bytes:
+                    self.evict()
+
+    def evict(self):
+        """removes the least recently used entries until the directory is
+        back under the cap, and recounts its size"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.extension):
+                try:
+                    status = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, name))
+
+        total = sum(size for (mtime, size, name) in entries)
+        if total > self.max_bytes:
+            for (mtime, size, name) in sorted(entries):
+                if total <= self.max_bytes * self.LOW_WATER:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                total -= size
+        self.total = total
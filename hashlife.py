@@ -0,0 +1,231 @@
+# HashLife: memoized quadtree Game of Life for far-future generations
+import itertools
+
+import numpy as np
+
+# nodes, and results, kept in the caches before the older half is dropped
+MAX_NODES = 1 << 20
+
+
+class Node:
+    """
+    A square of 2**k by 2**k cells made of four quadrants of level k - 1.
+    Level 0 nodes are single cells. Nodes are shared, so they are compared
+    by identity.
+    """
+    __slots__ = ('k', 'nw', 'ne', 'sw', 'se', 'population')
+
+    def __init__(self, k, nw, ne, sw, se, population):
+        self.k = k
+        self.nw = nw
+        self.ne = ne
+        self.sw = sw
+        self.se = se
+        self.population = population
+
+
+OFF = Node(0, None, None, None, None, 0)
+ON = Node(0, None, None, None, None, 1)
+
+
+def life(nw, n, ne, w, cell, e, sw, s, se):
+    """returns the next state of the cell in the middle of 3x3 level 0 nodes"""
+    total = nw.population + n.population + ne.population + w.population + \
+        e.population + sw.population + s.population + se.population
+    if total == 3 or (total == 2 and cell is ON):
+        return ON
+    return OFF
+
+
+def trimmed(cache):
+    """returns the newer half of a cache dictionary, entries being kept in
+    the order they were added"""
+    return dict(itertools.islice(cache.items(), len(cache) // 2, None))
+
+
+class HashLife:
+    """
+    An unbounded Game of Life universe stored as a hashed quadtree.
+
+    Cell (x, y) of the pattern at generation 0 has coordinates (x, y); the
+    coordinates of a cell don't change as the universe grows.
+    """
+
+    def __init__(self, max_nodes=MAX_NODES):
+        self.max_nodes = max_nodes
+        self.generation = 0
+        self._nodes = {}
+        self._results = {}
+        self._zeros = [OFF]
+        self.root = self.zero(3)
+        # coordinates of the top left cell of the root
+        self.origin = (0, 0)
+
+    @classmethod
+    def from_array(cls, cells, max_nodes=MAX_NODES):
+        """returns a universe holding a 2D bool array at (0, 0)"""
+        cells = np.asarray(cells, dtype=bool)
+        universe = cls(max_nodes)
+        k = 3
+        while 1 << k < max(cells.shape):
+            k += 1
+        square = np.zeros((1 << k, 1 << k), dtype=bool)
+        square[:cells.shape[0], :cells.shape[1]] = cells
+        universe.root = universe._build(square)
+        return universe
+
+    @classmethod
+    def from_rle(cls, rle, max_nodes=MAX_NODES):
+        """returns a universe holding the pattern of an RLE object"""
+        return cls.from_array(rle.to_array(), max_nodes)
+
+    def join(self, nw, ne, sw, se):
+        """returns the shared node made of four quadrants"""
+        key = (nw, ne, sw, se)
+        node = self._nodes.get(key)
+        if node is None:
+            node = Node(nw.k + 1, nw, ne, sw, se,
+                        nw.population + ne.population + sw.population + se.population)
+            if len(self._nodes) >= self.max_nodes:
+                self._trim()
+            self._nodes[key] = node
+        return node
+
+    def zero(self, k):
+        """returns the empty node of level k"""
+        while len(self._zeros) <= k:
+            z = self._zeros[-1]
+            self._zeros.append(self.join(z, z, z, z))
+        return self._zeros[k]
+
+    def _build(self, square):
+        if square.shape[0] == 1:
+            return ON if square[0, 0] else OFF
+        half = square.shape[0] // 2
+        if not square.any():
+            return self.zero(half.bit_length())
+        return self.join(self._build(square[:half, :half]), self._build(square[:half, half:]),
+                         self._build(square[half:, :half]), self._build(square[half:, half:]))
+
+    def center(self, node):
+        """returns node surrounded by empty space, one level up"""
+        z = self.zero(node.k - 1)
+        return self.join(self.join(z, z, z, node.nw), self.join(z, z, node.ne, z),
+                         self.join(z, node.sw, z, z), self.join(node.se, z, z, z))
+
+    def _life_4x4(self, m):
+        """returns the center 2x2 of a level 2 node one generation on"""
+        (a, b, c, d) = (m.nw, m.ne, m.sw, m.se)
+        return self.join(
+            life(a.nw, a.ne, b.nw, a.sw, a.se, b.sw, c.nw, c.ne, d.nw),
+            life(a.ne, b.nw, b.ne, a.se, b.sw, b.se, c.ne, d.nw, d.ne),
+            life(a.sw, a.se, b.sw, c.nw, c.ne, d.nw, c.sw, c.se, d.sw),
+            life(a.se, b.sw, b.se, c.ne, d.nw, d.ne, c.se, d.sw, d.se))
+
+    def successor(self, m, j):
+        """returns the center half of node m 2**j generations on, j <= m.k - 2"""
+        key = (m, j)
+        result = self._results.get(key)
+        if result is not None:
+            return result
+
+        if m.population == 0:
+            return m.nw
+        if m.k == 2:
+            result = self._life_4x4(m)
+        else:
+            (a, b, c, d) = (m.nw, m.ne, m.sw, m.se)
+            # nine overlapping sub-squares of level k - 1
+            parts = [[a, self.join(a.ne, b.nw, a.se, b.sw), b],
+                     [self.join(a.sw, a.se, c.nw, c.ne),
+                      self.join(a.se, b.sw, c.ne, d.nw),
+                      self.join(b.sw, b.se, d.nw, d.ne)],
+                     [c, self.join(c.ne, d.nw, c.se, d.sw), d]]
+            if j < m.k - 2:
+                # slow step: take the centers without advancing them
+                s = [[self._center_of(p) for p in row] for row in parts]
+                s = [[self.successor(self.join(s[r][q], s[r][q + 1], s[r + 1][q], s[r + 1][q + 1]), j)
+                      for q in range(2)] for r in range(2)]
+            else:
+                # full step: two half steps of 2**(k - 3) generations each
+                s = [[self.successor(p, m.k - 3) for p in row] for row in parts]
+                s = [[self.successor(self.join(s[r][q], s[r][q + 1], s[r + 1][q], s[r + 1][q + 1]), m.k - 3)
+                      for q in range(2)] for r in range(2)]
+            result = self.join(s[0][0], s[0][1], s[1][0], s[1][1])
+
+        if len(self._results) >= self.max_nodes:
+            self._trim()
+        self._results[key] = result
+        return result
+
+    def _center_of(self, node):
+        """returns the center half of a node"""
+        return self.join(node.nw.se, node.ne.sw, node.sw.ne, node.se.nw)
+
+    def _is_padded(self, node):
+        # all live cells are in the central quarter of the node
+        return node.population == node.nw.se.se.population + node.ne.sw.sw.population + \
+            node.sw.ne.ne.population + node.se.nw.nw.population
+
+    def _grow(self):
+        half = 1 << (self.root.k - 1)
+        self.root = self.center(self.root)
+        self.origin = (self.origin[0] - half, self.origin[1] - half)
+
+    def step(self, j):
+        """advances the universe 2**j generations"""
+        while self.root.k < j + 2 or not self._is_padded(self.root):
+            self._grow()
+        self._grow()
+        half = 1 << (self.root.k - 2)
+        self.root = self.successor(self.root, j)
+        self.origin = (self.origin[0] + half, self.origin[1] + half)
+        self.generation += 1 << j
+
+    def advance(self, generations):
+        """advances the universe by a number of generations, one power of
+        two at a time"""
+        j = 0
+        while generations:
+            if generations & 1:
+                self.step(j)
+            generations >>= 1
+            j += 1
+
+    def _trim(self):
+        # forget the older half of the nodes and results together, a result
+        # kept for a forgotten node would never be looked up again. Nodes in
+        # use stay valid, an equal node made later is only a second copy
+        self._nodes = trimmed(self._nodes)
+        self._results = trimmed(self._results)
+
+    @property
+    def population(self):
+        return self.root.population
+
+    def window(self, top, left, height, width):
+        """returns the cells of a rectangle as a 2D bool array"""
+        cells = np.zeros((height, width), dtype=bool)
+        self._paint(self.root, self.origin[1] - top, self.origin[0] - left, cells)
+        return cells
+
+    def _paint(self, node, row, col, cells):
+        # copy the live cells of node, whose top left is at (row, col)
+        size = 1 << node.k
+        if node.population == 0 or row >= cells.shape[0] or col >= cells.shape[1] or \
+                row + size <= 0 or col + size <= 0:
+            return
+        if node.k == 0:
+            cells[row, col] = True
+            return
+        half = size // 2
+        self._paint(node.nw, row, col, cells)
+        self._paint(node.ne, row, col + half, cells)
+        self._paint(node.sw, row + half, col, cells)
+        self._paint(node.se, row + half, col + half, cells)
+
+    def to_grid(self, grid, top=0, left=0):
+        """fills a dense grid with the rectangle of the universe whose top
+        left cell is (left, top)"""
+        grid[:] = self.window(top, left, grid.shape[0], grid.shape[1])
+        return grid
@@ -0,0 +1,132 @@
+# Game of Life stepped in horizontal strips by a pool of worker processes
+import argparse
+import multiprocessing
+import os
+import time
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# grids shared with the worker processes: the current generation and the next
+_grids = None
+
+
+def _attach(names, shape):
+    """pool initializer, maps the shared grids into the worker"""
+    global _grids
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    _grids = (blocks, [np.ndarray(shape, dtype=bool, buffer=block.buf) for block in blocks])
+
+
+def _step_strip(job):
+    """computes the rows start to stop of the next generation"""
+    (start, stop, x_offset, source) = job
+    (blocks, grids) = _grids
+    current = grids[source]
+
+    # the strip plus the last row of the strip above and the first row of
+    # the strip below, wrapping around the top and bottom of the grid
+    rows = np.take(current, range(start - 1, stop + 1), axis=0, mode='wrap').astype(np.uint8)
+
+    cells = rows[1:-1]
+    vertical = rows[:-2] + cells + rows[2:]
+    total = vertical + np.roll(vertical, 1, axis=1) + np.roll(vertical, -1, axis=1) - cells
+    new_rows = (total == 3) | ((cells == 1) & (total == 2))
+
+    # rows scroll independently, so the shift stays inside the strip
+    if x_offset:
+        new_rows = np.roll(new_rows, x_offset, axis=1)
+    grids[1 - source][start:stop] = new_rows
+
+
+def _release(pool, blocks):
+    pool.terminate()
+    pool.join()
+    for block in blocks:
+        block.unlink()
+        try:
+            block.close()
+        except BufferError:
+            # arrays over the block are still alive at interpreter exit
+            pass
+
+
+def strips(height, count):
+    """returns (start, stop) row ranges splitting height rows into count strips"""
+    bounds = np.linspace(0, height, min(count, height) + 1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class ParallelLife:
+    """
+    Steps a toroidal grid with a pool of worker processes. The grid lives in
+    shared memory and each worker computes one horizontal strip, reading the
+    halo rows it needs from the strips above and below.
+    """
+
+    def __init__(self, grid, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.shape = grid.shape
+        self.blocks = [shared_memory.SharedMemory(create=True, size=max(grid.size, 1)) for i in range(2)]
+        self.grids = [np.ndarray(self.shape, dtype=bool, buffer=block.buf) for block in self.blocks]
+        self.grids[0][:] = grid
+        self.current = 0
+        self.strips = strips(self.shape[0], self.workers)
+
+        self.pool = multiprocessing.Pool(self.workers, initializer=_attach,
+                                         initargs=([block.name for block in self.blocks], self.shape))
+        self._finalizer = weakref.finalize(self, _release, self.pool, self.blocks)
+
+    def step(self, grid=None, x_offset=0):
+        """advances one generation, then shifts x_offset columns, copying
+        the result into grid if given"""
+        jobs = [(start, stop, x_offset, self.current) for (start, stop) in self.strips]
+        self.pool.map(_step_strip, jobs)
+        self.current = 1 - self.current
+        if grid is not None:
+            grid[:] = self.grids[self.current]
+
+    def to_grid(self):
+        """returns a copy of the current generation"""
+        return self.grids[self.current].copy()
+
+    def close(self):
+        """stops the workers and frees the shared memory"""
+        self.grids = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how ParallelLife scales with the number of workers.")
+
+    parser.add_argument('--grid-size', dest='grid_size', type=int, default=4096)
+    parser.add_argument('--generations', dest='generations', type=int, default=20)
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, os.cpu_count()])
+
+    args = parser.parse_args()
+
+    grid = np.random.default_rng(0).random((args.grid_size, args.grid_size)) < 0.2
+
+    baseline = None
+    print(f'{args.grid_size}x{args.grid_size} grid, {args.generations} generations')
+    print('workers  ms/generation  speedup')
+    for workers in sorted(set(args.workers)):
+        with ParallelLife(grid, workers) as life:
+            life.step()
+            start = time.perf_counter()
+            for generation in range(args.generations):
+                life.step(x_offset=-1)
+            elapsed = (time.perf_counter() - start) / args.generations
+        baseline = baseline or elapsed
+        print(f'{workers:7d}  {elapsed * 1000:13.2f}  {baseline / elapsed:7.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# Per-stage wall time, call counts and peak memory for the command line tools
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class Profiler:
+    """
+    Records every stage as it runs: its wall time, and with memory on, the
+    most memory Python allocated during it over what was in use when it
+    started. Stages can be nested, a stage's peak includes its inner stages.
+
+    Stages run by other threads than the one that started the profiler are
+    not recorded.
+    """
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.thread = threading.get_ident()
+        self.events = []
+        # per stage name: [calls, total seconds, longest seconds, peak bytes]
+        self.stages = {}
+        # [memory in use at the start, peak so far] of each open stage
+        self.open = []
+        self.start_time = time.perf_counter()
+        if memory:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, args):
+        if threading.get_ident() != self.thread:
+            yield
+            return
+
+        if self.memory:
+            (current, peak) = tracemalloc.get_traced_memory()
+            if self.open:
+                self.open[-1][1] = max(self.open[-1][1], peak)
+            tracemalloc.reset_peak()
+            self.open.append([current, current])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = 0
+            if self.memory:
+                (begin, peak) = self.open.pop()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if self.open:
+                    self.open[-1][1] = max(self.open[-1][1], peak)
+                peak -= begin
+            self.record(name, args, start, elapsed, peak)
+
+    def record(self, name, args, start, elapsed, peak):
+        stats = self.stages.setdefault(name, [0, 0.0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3] = max(stats[3], peak)
+
+        # a complete event of the Chrome trace format, times in microseconds
+        self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': self.thread,
+                            'ts': (start - self.start_time) * 1e6, 'dur': elapsed * 1e6,
+                            'args': dict(args, peak_bytes=peak)})
+
+    def close(self):
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def summary(self):
+        """returns the totals of every stage, by stage name"""
+        return {name: {'calls': calls, 'seconds': total, 'longest_seconds': longest, 'peak_bytes': peak}
+                for (name, (calls, total, longest, peak)) in self.stages.items()}
+
+    def write(self, filename):
+        """writes the stages as JSON. The file opens in chrome://tracing or
+        Perfetto, the stage totals are under "stages"."""
+        with open(filename, 'w') as trace_file:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms', 'stages': self.summary()}, trace_file)
+
+    def print_summary(self, file=sys.stderr):
+        print(f'{"stage":20s} {"calls":>7s} {"total ms":>10s} {"longest ms":>11s} {"peak KiB":>10s}', file=file)
+        for (name, stats) in sorted(self.summary().items(), key=lambda item: -item[1]['seconds']):
+            print(f'{name:20s} {stats["calls"]:7d} {stats["seconds"] * 1000:10.1f} '
+                  f'{stats["longest_seconds"] * 1000:11.1f} {stats["peak_bytes"] / 1024:10.1f}', file=file)
+
+
+class NullProfiler:
+    """
+    The profiler used when profiling is off, its stages do nothing.
+    """
+    _stage = contextlib.nullcontext()
+
+    def stage(self, name, args):
+        return self._stage
+
+
+_profiler = NullProfiler()
+
+
+def stage(name, **args):
+    """
+    Returns a context manager that records the code in its with block as a
+    stage called name when profiling is on. The keyword arguments are saved
+    with the stage, for example the frame number.
+    """
+    return _profiler.stage(name, args)
+
+
+def start(memory=True):
+    """turns profiling on and returns the Profiler recording the stages"""
+    global _profiler
+    _profiler = Profiler(memory)
+    return _profiler
+
+
+def stop():
+    """turns profiling off and returns the Profiler that was recording"""
+    global _profiler
+    (profiler, _profiler) = (_profiler, NullProfiler())
+    if isinstance(profiler, Profiler):
+        profiler.close()
+    return profiler
+
+
+@contextlib.contextmanager
+def profiled(filename):
+    """
+    Profiles the with block and writes the stages to filename, or does
+    nothing if filename is None
+    """
+    if filename is None:
+        yield
+        return
+
+    profiler = start()
+    try:
+        with stage('total'):
+            yield
+    finally:
+        stop()
+        profiler.write(filename)
+        profiler.print_summary()
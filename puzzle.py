@@ -4,8 +4,9 @@ import segno
 
 import numpy
 
-from CSEPixelArt import save_anim, save_img
+from CSEPixelArt import export_anim, export_img
 from morse import encrypt
+import profiling
 
 COMMENT = 'Created for UCSD CSE Pixel Art Competition 2021\n' +\
           'https://pixel-art.goto.ucsd.edu/\n' + \
@@ -105,14 +106,21 @@ def main():
     parser.add_argument('--count', action='store_true', required=False)
     parser.add_argument('--message', dest='message', required=False)
     parser.add_argument('--morse', dest='morse', required=False)
+    parser.add_argument('--profile', dest='profile', required=False)
 
     args = parser.parse_args()
 
+    with profiling.profiled(args.profile):
+        make_puzzle(args)
+
+
+def make_puzzle(args):
     qr_image = None
     if args.qr:
-        qr = segno.make(args.qr)
-        if qr.designator == 'M1':
-            qr_image = qr_to_image(qr)
+        with profiling.stage('qr'):
+            qr = segno.make(args.qr)
+            if qr.designator == 'M1':
+                qr_image = qr_to_image(qr)
 
     if args.count and qr_image:
         pixels = [pixel for column in qr_image for pixel in column if pixel == BLACK]
@@ -122,19 +130,22 @@ def main():
     output_images = None
 
     if args.message:
-        output_image = encode_message(qr_image, args.message)
+        with profiling.stage('encode message'):
+            output_image = encode_message(qr_image, args.message)
 
     if args.morse and output_image:
-        output_images = encode_morse(output_image, args.morse)
+        with profiling.stage('encode morse'):
+            output_images = encode_morse(output_image, args.morse)
 
     image_name = os.path.splitext(args.name)[0]
     if output_image and not output_images:
-        save_img(output_image, image_name + ENCODED + PNG, scale=1)
-        save_img(output_image, image_name + ENCODED + LARGE + PNG, scale=10)
+        with profiling.stage('export'):
+            export_img(output_image, {1: image_name + ENCODED + PNG, 10: image_name + ENCODED + LARGE + PNG})
 
     if output_images:
-        save_anim(output_images, image_name + ENCODED + GIF, scale=1, comment=COMMENT)
-        save_anim(output_images, image_name + ENCODED + LARGE + GIF, scale=10, comment=COMMENT)
+        with profiling.stage('export'):
+            export_anim(output_images, {1: image_name + ENCODED + GIF, 10: image_name + ENCODED + LARGE + GIF},
+                        comment=COMMENT)
 
 
 # call main
@@ -1,8 +1,15 @@
-from PIL import Image, ImageDraw
+from PIL import Image, ImageColor
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from filecache import FileCache
 import argparse
+import glob
 import logging
+import numpy as np
 import os
+import profiling
 import re
+import struct
 import sys
 
 
@@ -20,13 +27,15 @@ def setup_parser():
                     formatter_class = argparse.RawTextHelpFormatter,
                     )
     parser.add_argument('source',
-                        help = 'path to rle file',
+                        help = 'path to rle file, or a directory or glob' \
+                               + ' pattern of rle files to convert in batch',
                         )
     parser.add_argument('target',
                         nargs = '?',
                         default = '',
                         help = "optional: path to image file, extension" \
-                               + " determines image format",
+                               + " determines image format\n" \
+                               + "in batch mode, directory for the images",
                         )
     parser.add_argument('-s',
                         '--scale',
@@ -35,6 +44,46 @@ def setup_parser():
                         help = 'scale factor',
                         metavar = 'scale',
                         )
+    parser.add_argument('--on-color',
+                        default = 'black',
+                        help = 'color of live cells, a name or #rrggbb',
+                        metavar = 'color',
+                        )
+    parser.add_argument('--off-color',
+                        default = 'white',
+                        help = 'color of dead cells, a name or #rrggbb',
+                        metavar = 'color',
+                        )
+    parser.add_argument('--grid-color',
+                        default = None,
+                        help = 'optional: draw lines around cells in this color, one pixel wide',
+                        metavar = 'color',
+                        )
+    parser.add_argument('-j',
+                        '--jobs',
+                        default = os.cpu_count(),
+                        type = int,
+                        help = 'number of processes converting in batch mode',
+                        metavar = 'jobs',
+                        )
+    parser.add_argument('-f',
+                        '--force',
+                        action = 'store_true',
+                        help = 'in batch mode, also convert files whose' \
+                               + ' image is newer than the rle file',
+                        )
+    parser.add_argument('--cache',
+                        default = None,
+                        help = 'optional: directory of decoded patterns' \
+                               + ' reused between runs',
+                        metavar = 'directory',
+                        )
+    parser.add_argument('--profile',
+                        default = None,
+                        help = 'optional: write the time and memory of' \
+                               + ' each stage to this JSON trace file',
+                        metavar = 'file',
+                        )
     return parser
 
 
@@ -63,42 +112,175 @@ class Configuration:
         return nonempty_lines
 
 
+# matches "x = #, y = #" with an optional ", rule = ..." after it
+HEADER_REGEX = re.compile(r'x\s*=\s*(\d+)\s*,\s*y\s*=\s*(\d+)(?:\s*,\s*rule\s*=\s*(\S+))?',
+                          re.IGNORECASE)
+
+# matches a run: an optional count followed by a cell state, $ or !
+SEQUENCE_REGEX = re.compile(r'(\d*)([a-zA-Z.$!])')
+
+
 class RLE(Configuration):
     def __init__(self, rle):
-        dimensions_regex = \
-            'x\s*=\s(\d+)\s*,\s*y\s*=\s(\d+)' # regex matches "x = #, y = #"
-
         def exit_unless(success):
             if not success: exit('Read RLE error.')
 
         lines = self.read_configuration(rle)
 
-        match = re.search(dimensions_regex, next(lines))
+        match = HEADER_REGEX.search(next(lines, ''))
         if match != None:
             x = int(match.group(1))
             y = int(match.group(2))
             self.dimensions = (x, y)
+            self.rule = match.group(3) or 'B3/S23'
         else:
             exit_unless(False)
 
+        # a run count may be split over two lines, joining the lines
+        # without a separator puts it back together
         self.specifications = ''.join(lines)
+        self._sequences = None
+
+    def sequences(self):
+        """
+        Generates the runs of the pattern as (symbol, length) in a single
+        pass. Dead cells are reported as 'b', cells in any live state as
+        'o', the end of length rows as '$', and the end of the pattern as
+        ('!', 0).
+        """
+        for match in SEQUENCE_REGEX.finditer(self.specifications):
+            (count, symbol) = match.groups()
+            if symbol == '!':
+                break
+            length = int(count) if count else 1
+            if symbol == '$':
+                yield ('$', length)
+            elif symbol in 'b.':
+                yield ('b', length)
+            else:
+                yield ('o', length)
+        yield ('!', 0)
+
+    __iter__ = sequences
+
+    def to_array(self, dtype=bool):
+        """
+        Decodes the whole pattern at once into an array of y rows by x
+        columns, clipping any runs that reach past the dimensions.
+        """
+        (x, y) = self.dimensions
+        body = ''.join(self.specifications.partition('!')[0].split())
+        text = np.frombuffer(body.encode('ascii', 'replace'), dtype=np.uint8)
+
+        # every character that is not a digit ends a run, the digits before
+        # it give the run length
+        digit = (text >= ord('0')) & (text <= ord('9'))
+        ends = np.flatnonzero(~digit)
+        symbols = text[ends]
+        digits = np.flatnonzero(digit)
+        run = np.searchsorted(ends, digits)
+        digits = digits[run < len(ends)]
+        run = run[run < len(ends)]
+        places = 10.0 ** (ends[run] - digits - 1)
+        counts = np.bincount(run, weights=(text[digits] - ord('0')) * places, minlength=len(ends))
+        lengths = np.where(np.bincount(run, minlength=len(ends)) > 0, np.rint(counts), 1).astype(np.int64)
+
+        row_end = symbols == ord('$')
+        live = ~row_end & (symbols != ord('b')) & (symbols != ord('.'))
+
+        # row of each run, and its column from the position along the
+        # pattern minus the position where its row started
+        rows = np.cumsum(np.where(row_end, lengths, 0))
+        widths = np.where(row_end, 0, lengths)
+        position = np.cumsum(widths)
+        row_start = np.maximum.accumulate(np.where(row_end, position, 0))
+        starts = position - widths - row_start
+        stops = np.minimum(starts + lengths, x)
+
+        keep = live & (rows < y) & (starts < x)
+        offsets = rows[keep] * x
+
+        # mark where live runs start and stop, a running sum fills them in
+        cells = np.zeros(y * x + 1, dtype=np.int8)
+        cells[offsets + starts[keep]] += 1
+        cells[offsets + stops[keep]] -= 1
+        np.cumsum(cells, dtype=np.int8, out=cells)
+        return cells[:-1].reshape(y, x).astype(dtype)
 
     def next_sequence(self):
-        specifications_regex = \
-            '(\$)|(!)|(\d*b)|(\d*o)' # regex matches $, !, #b, #o
-
-        match = re.search(specifications_regex, self.specifications)
-        specification = match.group()
-        self.specifications = self.specifications[len(specification):]
-        if specification == '$':
-            return ('$', 0)
-        elif specification == '!':
-            self.specifications = '!'
-            return ('!', 0)
-        else:
-            if len(specification) == 1:
-                specification = '1' + specification
-            return (specification[-1], int(specification[0:-1]))
+        if self._sequences is None:
+            self._sequences = self.sequences()
+        return next(self._sequences, ('!', 0))
+
+
+# a decoded pattern: (x, y) dimensions, rule string and y by x bool cells
+Pattern = namedtuple('Pattern', ['dimensions', 'rule', 'cells'])
+
+
+class PatternCache:
+    """
+    Decoded patterns kept as small binary files in a directory, so a pattern
+    is only parsed again when its source file changes. Entries are keyed by
+    the source path, modification time and size. When the directory grows
+    past max_bytes the least recently used entries are removed.
+
+    Entry format: magic, x, y, length of the rule, the rule, then the cells
+    packed eight to a byte.
+    """
+    MAGIC = b'RLE1'
+    HEADER = struct.Struct('<4sIIH')
+    EXTENSION = '.pattern'
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.files = FileCache(directory, max_bytes, self.EXTENSION)
+
+    def entry(self, source):
+        status = os.stat(source)
+        return self.files.entry('%s\0%d\0%d' % (os.path.abspath(source), status.st_mtime_ns, status.st_size))
+
+    def load(self, source):
+        entry = self.entry(source)
+        try:
+            pattern = self.read(entry)
+            self.files.touch(entry)
+            return pattern
+        except (OSError, ValueError, struct.error):
+            pass
+
+        rle = RLE(source)
+        pattern = Pattern(rle.dimensions, rle.rule, rle.to_array())
+        self.write(entry, pattern)
+        return pattern
+
+    def read(self, entry):
+        with open(entry, 'rb') as entry_file:
+            data = entry_file.read()
+        (magic, x, y, rule_length) = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC:
+            raise ValueError('Not a pattern cache entry.')
+        start = self.HEADER.size + rule_length
+        rule = data[self.HEADER.size:start].decode()
+        bits = np.frombuffer(data, dtype=np.uint8, offset=start)
+        cells = np.unpackbits(bits, count=x * y).reshape(y, x).view(bool)
+        return Pattern((x, y), rule, cells)
+
+    def write(self, entry, pattern):
+        (x, y) = pattern.dimensions
+        rule = pattern.rule.encode()
+
+        def write_entry(entry_file):
+            entry_file.write(self.HEADER.pack(self.MAGIC, x, y, len(rule)) + rule)
+            entry_file.write(np.packbits(pattern.cells).tobytes())
+
+        self.files.write(entry, write_entry)
+
+
+def read_pattern(source, cache=None):
+    """returns the decoded Pattern of an rle file, through cache if given"""
+    if cache is not None:
+        return cache.load(source)
+    rle = RLE(source)
+    return Pattern(rle.dimensions, rle.rule, rle.to_array())
 
 
 def get_paths(source, target):
@@ -122,34 +304,112 @@ def get_paths(source, target):
         exit_unless(False)
 
 
-def make_image(source, target, scale):
-    rle = RLE(source)
-    (x, y) = rle.dimensions
-
-    im = Image.new('RGBA', (scale * x, scale * y), 'white')
-    draw = ImageDraw.Draw(im)
-
-    xp = 0
-    yp = 0
-    (symbol, length) = rle.next_sequence()
-    while symbol != '!':
-        if symbol == '$':
-            xp = 0
-            yp += scale
-        elif symbol == 'b':
-            xp += scale * length
-        else:
-            draw.rectangle((xp, yp, xp + scale * length - 1, yp + scale - 1), 'black')
-            xp += scale * length
-        (symbol, length) = rle.next_sequence()
-
-    im.save(target)
+# matches the wildcards of a glob pattern
+GLOB_REGEX = re.compile(r'[*?[]')
+
+
+def glob_root(source):
+    """returns the directory part of a glob pattern before any wildcard"""
+    parts = []
+    for part in source.split(os.sep):
+        if GLOB_REGEX.search(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts)
+
+
+def find_sources(source):
+    """returns the rle files of a directory tree or a glob pattern"""
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '**', '*.rle'), recursive=True))
+    return sorted(path for path in glob.glob(source, recursive=True) if os.path.isfile(path))
+
+
+def batch_paths(source, target):
+    """
+    Returns (source, target) pairs for every file matched by source. Images
+    are named by get_paths; with a target directory they go there,
+    keeping the layout of a source directory.
+    """
+    sources = find_sources(source)
+    root = source if os.path.isdir(source) else glob_root(source)
+    paths = []
+    for path in sources:
+        target_path = ''
+        if target:
+            target_path = os.path.join(target, os.path.dirname(os.path.relpath(path, root)), '')
+        paths.append(get_paths(path, target_path))
+    return paths
+
+
+def up_to_date(source, target):
+    return os.path.isfile(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+def make_images(paths, scale, jobs, cache=None, force=False, **colors):
+    """
+    Converts (source, target) pairs on a pool of processes, reporting
+    failures as they happen. Returns the number of files converted and
+    the list of sources that failed.
+    """
+    if not force:
+        paths = [(source, target) for (source, target) in paths if not up_to_date(source, target)]
+
+    failures = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for (source, target) in paths:
+            target_path = os.path.dirname(target)
+            if target_path:
+                os.makedirs(target_path, exist_ok=True)
+            futures[executor.submit(make_image, source, target, scale, cache, **colors)] = source
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (Exception, SystemExit) as error:
+                failures.append(futures[future])
+                print('%s: %s' % (futures[future], error), file=sys.stderr, flush=True)
+    return (len(paths), failures)
+
+
+def make_image(source, target, scale, cache=None,
+               on_color='black', off_color='white', grid_color=None):
+    with profiling.stage('read pattern'):
+        pattern = read_pattern(source, cache)
+
+    with profiling.stage('render'):
+        # palette indices: 0 for dead cells, 1 for live cells, 2 for grid lines
+        pixels = pattern.cells.view(np.uint8)
+        if scale > 1:
+            pixels = pixels.repeat(scale, axis=0).repeat(scale, axis=1)
+        colors = [off_color, on_color]
+        if grid_color is not None and scale > 1:
+            pixels[::scale, :] = 2
+            pixels[:, ::scale] = 2
+            # a last line closes the bottom and right of the grid
+            pixels = np.pad(pixels, ((0, 1), (0, 1)), constant_values=2)
+            colors.append(grid_color)
+
+        im = Image.fromarray(pixels, 'P')
+        im.putpalette([channel for color in colors for channel in ImageColor.getrgb(color)[:3]])
+
+        # formats without palettes get plain RGB
+        if os.path.splitext(target)[1].lower() in ('.jpg', '.jpeg'):
+            im = im.convert('RGB')
+
+    with profiling.stage('save'):
+        im.save(target)
 
 
 def main(argv):
     parser = setup_parser()
     parsed_args = parser.parse_args(argv)
 
+    with profiling.profiled(parsed_args.profile):
+        convert(parsed_args)
+
+
+def convert(parsed_args):
     source = parsed_args.source
     target = parsed_args.target
 
@@ -157,8 +417,33 @@ def main(argv):
     if scale < 1:
         exit('Scale factor cannot be less than 1.')
 
+    cache = None
+    if parsed_args.cache:
+        cache = PatternCache(parsed_args.cache)
+
+    colors = {'on_color': parsed_args.on_color,
+              'off_color': parsed_args.off_color,
+              'grid_color': parsed_args.grid_color}
+
+    # an existing file is converted on its own, even if its name has
+    # characters that are wildcards in a glob pattern
+    if not os.path.isfile(source) and (os.path.isdir(source) or GLOB_REGEX.search(source)):
+        paths = batch_paths(source, target)
+        if not paths:
+            exit('No rle files match %s.' % source)
+        # the files are converted by worker processes, only the batch as a
+        # whole is profiled
+        with profiling.stage('batch', files=len(paths)):
+            (converted, failures) = make_images(paths, scale, parsed_args.jobs, cache, parsed_args.force,
+                                                **colors)
+        print('%d files, %d converted, %d up to date, %d failed' \
+              % (len(paths), converted - len(failures), len(paths) - converted, len(failures)))
+        if failures:
+            exit(1)
+        return
+
     (source, target) =  get_paths(source, target)
-    make_image(source, target, scale)
+    make_image(source, target, scale, cache, **colors)
 
 
 if __name__ == '__main__':
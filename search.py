@@ -0,0 +1,163 @@
+# Search many seeded random soups for long-lived or oscillating patterns
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from conway import neighbor_count, random_grid, state_digest
+
+GENERATIONS = 1000
+
+# longest period recognized, older states are not remembered. By default
+# it is 4 times the grid size, the period of a glider going round the grid
+MAX_PERIOD = None
+
+BATCH_SIZE = 512
+
+# a soup is kept if it runs this long before it dies or settles
+MIN_GENERATIONS = 800
+
+# a soup settling into an oscillator is kept if the period is at least this,
+# periods 1 and 2 (blocks, blinkers) turn up in almost every soup
+MIN_PERIOD = 3
+
+
+def step_soups(soups):
+    """advances a stack of grids one generation"""
+    total = neighbor_count(soups)
+    return (total == 3) | (soups & (total == 2))
+
+
+def digests(soups):
+    """returns the state_digest of every grid of a stack as two uint64"""
+    return np.frombuffer(b''.join(state_digest(soup) for soup in soups), dtype=np.uint64).reshape(-1, 2)
+
+
+def classify(seeds, grid_size, generations=GENERATIONS, max_period=MAX_PERIOD):
+    """
+    Steps the soups made by random_grid(grid_size, seed) for each seed
+    together, and returns one result per seed as a dictionary: its seed, its
+    class and the generation it was found at.
+
+    dies: no cells are left
+    stable: the soup stopped changing (period 1)
+    oscillates: the soup repeats every period generations (up to max_period)
+    survives: still changing after the given number of generations, or
+    repeating with a period longer than max_period
+
+    States are remembered by a 128 bit digest rather than by their cells.
+    """
+    max_period = max_period or 4 * grid_size
+    seeds = np.asarray(seeds)
+    soups = np.stack([random_grid(grid_size, int(seed)) for seed in seeds])
+
+    # digests of the last max_period states of every soup, the state of
+    # generation g in slot g % max_period
+    history = np.zeros((len(seeds), max_period, 2), dtype=np.uint64)
+    history[:, 0] = digests(soups)
+    results = []
+    for generation in range(1, generations + 1):
+        soups = step_soups(soups)
+        digest = digests(soups)
+
+        # distance back to the last equal state, 0 if none, from how many
+        # generations back each slot is
+        back = (generation - np.arange(max_period) - 1) % max_period + 1
+        same = (history == digest[:, None, :]).all(axis=2) & (back <= generation)
+        periods = np.where(same, back, max_period + 1).min(axis=1)
+        periods[periods > max_period] = 0
+        population = soups.sum(axis=(1, 2))
+
+        history[:, generation % max_period] = digest
+
+        done = (population == 0) | (periods > 0)
+        if not done.any():
+            continue
+        for i in np.flatnonzero(done):
+            if population[i] == 0:
+                kind = 'dies'
+            elif periods[i] == 1:
+                kind = 'stable'
+            else:
+                kind = 'oscillates'
+            # the generation the soup settled at, before its first repeat
+            results.append({'seed': int(seeds[i]), 'class': kind, 'period': int(periods[i]),
+                            'generation': generation - int(periods[i]), 'population': int(population[i])})
+
+        # finished soups leave the batch
+        keep = ~done
+        (soups, seeds, history) = (soups[keep], seeds[keep], history[keep])
+        if not len(seeds):
+            break
+
+    population = soups.sum(axis=(1, 2))
+    for (seed, count) in zip(seeds, population):
+        results.append({'seed': int(seed), 'class': 'survives', 'period': 0,
+                        'generation': generations, 'population': int(count)})
+    return results
+
+
+def interesting(result, min_generations=MIN_GENERATIONS, min_period=MIN_PERIOD):
+    """returns whether a soup is worth keeping"""
+    return result['class'] == 'survives' or result['generation'] >= min_generations or \
+        (result['class'] == 'oscillates' and result['period'] >= min_period)
+
+
+def search_batch(start, count, grid_size, generations, max_period, min_generations, min_period):
+    """classifies the soups of seeds start to start + count, returning the
+    number of soups of each class and the interesting ones"""
+    results = classify(range(start, start + count), grid_size, generations, max_period)
+    counts = {}
+    for result in results:
+        counts[result['class']] = counts.get(result['class'], 0) + 1
+    return (counts, [result for result in results if interesting(result, min_generations, min_period)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Searches random soups for long-lived or oscillating patterns. "
+                                                 "Each soup found is drawn again by conway.py --seed.")
+
+    parser.add_argument('--grid-size', dest='grid_size', type=int, default=32)
+    parser.add_argument('--soups', dest='soups', type=int, default=100000)
+    parser.add_argument('--start-seed', dest='start_seed', type=int, default=0)
+    parser.add_argument('--generations', dest='generations', type=int, default=GENERATIONS)
+    parser.add_argument('--max-period', dest='max_period', type=int, default=MAX_PERIOD)
+    parser.add_argument('--min-generations', dest='min_generations', type=int, default=MIN_GENERATIONS)
+    parser.add_argument('--min-period', dest='min_period', type=int, default=MIN_PERIOD)
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--jobs', dest='jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--output', dest='output', required=False,
+                        help='file the interesting soups are written to, one JSON object per line')
+
+    args = parser.parse_args()
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    totals = {}
+    found = 0
+    start = time.perf_counter()
+    stop = args.start_seed + args.soups
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(search_batch, first, min(args.batch_size, stop - first), args.grid_size,
+                                   args.generations, args.max_period, args.min_generations, args.min_period)
+                   for first in range(args.start_seed, stop, args.batch_size)]
+        for future in as_completed(futures):
+            (counts, results) = future.result()
+            for (kind, count) in counts.items():
+                totals[kind] = totals.get(kind, 0) + count
+            for result in sorted(results, key=lambda result: result['seed']):
+                print(json.dumps(dict(result, grid_size=args.grid_size)), file=output, flush=True)
+            found += len(results)
+    elapsed = time.perf_counter() - start
+
+    if output is not sys.stdout:
+        output.close()
+    summary = ', '.join(f'{count} {kind}' for (kind, count) in sorted(totals.items()))
+    print(f'{args.soups} soups in {elapsed:.1f} seconds: {summary}. {found} kept.', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Game of Life step that only visits the tiles around live cells
+import numpy as np
+
+TILE_SIZE = 16
+
+# a tile and its eight neighbors, as (row, column) tile offsets
+NEIGHBORHOOD = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+
+
+class SparseLife:
+    """
+    Steps a toroidal grid by recomputing only the tiles that hold live cells
+    and the tiles next to them, so a generation costs time in proportion to
+    the population rather than the area of the grid.
+
+    The positions of the live cells are remembered between steps, so the
+    grid must only be changed through step once the SparseLife is created.
+    """
+
+    def __init__(self, grid, tile_size=TILE_SIZE):
+        (self.height, self.width) = grid.shape
+        self.tile_size = tile_size
+        self.tile_rows = -(-self.height // tile_size)
+        self.tile_cols = -(-self.width // tile_size)
+        (self.rows, self.cols) = np.nonzero(grid)
+
+    def _candidate_tiles(self):
+        # tiles holding live cells, grown by one tile in every direction
+        tile_rows = self.rows // self.tile_size
+        tile_cols = self.cols // self.tile_size
+        tiles = np.unique(tile_rows * self.tile_cols + tile_cols)
+        (tile_rows, tile_cols) = np.divmod(tiles, self.tile_cols)
+
+        grown = [((tile_rows + dr) % self.tile_rows) * self.tile_cols + (tile_cols + dc) % self.tile_cols
+                 for (dr, dc) in NEIGHBORHOOD]
+        return np.divmod(np.unique(np.concatenate(grown)), self.tile_cols)
+
+    def step(self, grid, x_offset=0):
+        """advances grid one generation, then shifts it x_offset columns"""
+        if len(self.rows) == 0:
+            return
+
+        (tile_rows, tile_cols) = self._candidate_tiles()
+
+        # each candidate tile with a one cell halo, wrapping around the edges
+        span = np.arange(-1, self.tile_size + 1)
+        row_index = (tile_rows[:, None] * self.tile_size + span) % self.height
+        col_index = (tile_cols[:, None] * self.tile_size + span) % self.width
+        blocks = grid[row_index[:, :, None], col_index[:, None, :]].astype(np.uint8)
+
+        # apply Conway's rules inside the halo
+        cells = blocks[:, 1:-1, 1:-1]
+        vertical = blocks[:, :-2] + blocks[:, 1:-1] + blocks[:, 2:]
+        total = vertical[:, :, :-2] + vertical[:, :, 1:-1] + vertical[:, :, 2:] - cells
+        alive = (total == 3) | ((cells == 1) & (total == 2))
+
+        # every live cell is inside a candidate tile, so clearing the old
+        # cells and setting the new ones updates the whole grid
+        (tile, row, col) = np.nonzero(alive)
+        rows = row_index[tile, row + 1]
+        cols = (col_index[tile, col + 1] + x_offset) % self.width
+
+        grid[self.rows, self.cols] = False
+        grid[rows, cols] = True
+
+        # partial tiles at the edges can compute the same cell twice
+        cells = np.unique(rows * self.width + cols)
+        (self.rows, self.cols) = np.divmod(cells, self.width)